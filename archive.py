@@ -0,0 +1,54 @@
+# backup of the md directory and the image cache in a single file
+import os, sys, argparse, time
+
+from utils.util_archive import Archive, export_backup, import_backup
+
+def export_command(args):
+    print(f"Packing {args.md_dir} and {args.cache_dir} in {args.output}")
+    start = time.perf_counter()
+    nb_files, nb_blobs = export_backup(args.output, args.md_dir, args.cache_dir)
+    size = os.path.getsize(args.output)
+    print(f"Packed {nb_files} files, {nb_blobs} distinct contents, {size / 1024 / 1024:.1f} MB in {time.perf_counter() - start:.1f}s")
+
+def import_command(args):
+    print(f"Extracting {args.archive} in {args.target_dir}")
+    start = time.perf_counter()
+    nb_files = import_backup(args.archive, args.target_dir)
+    print(f"Extracted {nb_files} files in {time.perf_counter() - start:.1f}s")
+
+def list_command(args):
+    archive = Archive(args.archive)
+    try:
+        for path in archive.list_files(args.prefix):
+            print(path)
+    finally:
+        archive.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="pack the md directory and the image cache in one file")
+    export_parser.add_argument("-o", "--output", default="backup.db", help="archive file")
+    export_parser.add_argument("--md_dir", default="md", help="md directory")
+    export_parser.add_argument("-c", "--cache_dir", default="cache", help="cache directory")
+    import_parser = subparsers.add_parser("import", help="extract an archive, identical images are hardlinked")
+    import_parser.add_argument("archive", help="archive file")
+    import_parser.add_argument("-t", "--target_dir", default=".", help="directory where md/ and cache/ are extracted")
+    list_parser = subparsers.add_parser("list", help="list the files of an archive")
+    list_parser.add_argument("archive", help="archive file")
+    list_parser.add_argument("prefix", nargs="?", default="", help="only the files under this path, e.g. md/2023/")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            export_command(args)
+        elif args.command == "import":
+            import_command(args)
+        elif args.command == "list":
+            list_command(args)
+    except FileNotFoundError as e:
+        print(f"File not found: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# maintenance of the image cache
+import os, sys, argparse, itertools
+from collections import Counter, deque, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.util_scrap import Cache, HeicConverter, IMAGE_EXTENSIONS, check_images, hash_images
+from utils.util_file import link_file, hash_file
+
+# images decoded by each task of the fsck process pool
+CHECK_BATCH = 64
+# fsck prints its progress every PROGRESS_EVERY entries or files
+PROGRESS_EVERY = 1000
+# bits of the perceptual hash of dedup
+HASH_BITS = 64
+# mean difference of the 8x8 colour thumbnails (0-255) above which two images with close hashes are different
+MAX_COLOUR_DIFFERENCE = 2.0
+# relative difference of the aspect ratios above which two images are different
+MAX_RATIO_DIFFERENCE = 0.02
+# extensions which can be merged, a jpeg content is never put in a png file
+IMAGE_KINDS = {'.jpeg': '.jpg'}
+
+def store_blobs(cache):
+    print(f"Adding images of {cache.images_dir} to the blob store")
+    nb_files = cache.store_all_blobs()
+    print(f"Linked {nb_files} images to their blob")
+
+def convert_heic(cache, workers):
+    converter = HeicConverter(workers)
+    try:
+        nb_converted = cache.convert_all_heic(converter)
+    finally:
+        converter.shutdown()
+    print(f"Converted {nb_converted} HEIC images")
+
+def iter_batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def check_files(file_paths, workers=None, function=check_images):
+    """Decode the images in a process pool, yields (number of files checked, result of function) for each batch.
+    Only a few batches per process are queued, so memory does not depend on the number of files"""
+    workers = workers or os.cpu_count() or 1
+    batches = iter_batches(file_paths, CHECK_BATCH)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for batch in itertools.islice(batches, 4 * workers):
+            pending.append((len(batch), executor.submit(function, batch)))
+        while pending:
+            nb_files, future = pending.popleft()
+            for batch in itertools.islice(batches, 1):
+                pending.append((len(batch), executor.submit(function, batch)))
+            yield nb_files, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def check_index(cache, gc):
+    """Index entries whose file is missing"""
+    print(f"Checking the index {cache.cache.db_path}")
+    nb_entries = 0
+    nb_dangling = 0
+    for url, filename in cache.cache.iter_items():
+        nb_entries += 1
+        if not filename or not os.path.isfile(cache.get_filepath(filename)):
+            nb_dangling += 1
+            print(f"Dangling entry: {url} -> {filename or 'no filename'}")
+            if gc:
+                del cache.cache[url]
+        if nb_entries % PROGRESS_EVERY == 0:
+            print(f"Checked {nb_entries} entries, {nb_dangling} dangling")
+    return nb_entries, nb_dangling
+
+def is_heic_original(cache, filename):
+    """True if filename is a HEIC file kept next to its JPEG conversion, which is in the index.
+    The conversion of IMG_1.HEIC is IMG_1.jpg, with "_" prefixes when the name was already taken"""
+    if not filename.lower().endswith('.heic'):
+        return False
+    # add_downloaded_file cuts the name at its first dot, convert_all_heic at its last one
+    for stem in {filename.split('.')[0], filename.rsplit('.', 1)[0]}:
+        jpg_filename = stem + ".jpg"
+        while cache.is_file_in_cache(jpg_filename) or os.path.exists(cache.get_filepath(jpg_filename)):
+            if cache.is_file_in_cache(jpg_filename):
+                return True
+            jpg_filename = "_" + jpg_filename
+    return False
+
+def check_orphans(cache, gc):
+    """Files of the images directory which are not in the index, and count of the files per extension.
+    The HEIC originals of the converted images are not orphans"""
+    print(f"Checking the files of {cache.images_dir}")
+    extensions = Counter()
+    nb_files = 0
+    nb_orphans = 0
+    for entry in os.scandir(cache.images_dir):
+        if not entry.is_file():
+            continue
+        nb_files += 1
+        extensions[os.path.splitext(entry.name)[1].lower()] += 1
+        if not cache.is_file_in_cache(entry.name) and not is_heic_original(cache, entry.name):
+            nb_orphans += 1
+            print(f"Orphan file: {entry.name}")
+            if gc:
+                os.remove(entry.path)
+        if nb_files % PROGRESS_EVERY == 0:
+            print(f"Checked {nb_files} files, {nb_orphans} orphans")
+    return nb_files, nb_orphans, extensions
+
+def check_decode(cache, workers, gc):
+    """Images of the index which are empty or can not be decoded, e.g. truncated downloads"""
+    def image_paths():
+        for entry in os.scandir(cache.images_dir):
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS) and cache.is_file_in_cache(entry.name):
+                yield entry.path
+
+    print(f"Decoding the images of {cache.images_dir}")
+    nb_images = 0
+    nb_broken = 0
+    next_progress = PROGRESS_EVERY
+    for nb_files, errors in check_files(image_paths(), workers):
+        nb_images += nb_files
+        for file_path, error in errors:
+            nb_broken += 1
+            filename = os.path.basename(file_path)
+            print(f"Broken image: {filename}: {error}")
+            if gc:
+                # the image will be downloaded again by the next scrap
+                os.remove(file_path)
+                cache.cache.delete_filename(filename)
+        if nb_images >= next_progress:
+            print(f"Decoded {nb_images} images, {nb_broken} broken")
+            next_progress += PROGRESS_EVERY
+    return nb_images, nb_broken
+
+def check_leftovers(cache, gc):
+    """Unfinished downloads in tmp/, and blobs no longer linked from any image"""
+    nb_tmp = 0
+    for entry in os.scandir(cache.tmp_dir):
+        if entry.is_file():
+            nb_tmp += 1
+            if gc:
+                os.remove(entry.path)
+    nb_blobs = 0
+    for root, dirs, files in os.walk(cache.blobs_dir):
+        for file in files:
+            blob_path = os.path.join(root, file)
+            # the only link left is the blob itself
+            if os.stat(blob_path).st_nlink == 1:
+                nb_blobs += 1
+                if gc:
+                    os.remove(blob_path)
+    return nb_tmp, nb_blobs
+
+def fsck(cache, workers=None, gc=False, decode=True):
+    """Check the cache: dangling index entries, orphan files, broken images and leftovers.
+    With gc, the problems found are removed. Returns the number of problems"""
+    nb_entries, nb_dangling = check_index(cache, gc)
+    nb_files, nb_orphans, extensions = check_orphans(cache, gc)
+    nb_images, nb_broken = 0, 0
+    if decode:
+        nb_images, nb_broken = check_decode(cache, workers, gc)
+    nb_tmp, nb_blobs = check_leftovers(cache, gc)
+
+    print(f"{nb_entries} index entries, {nb_dangling} dangling")
+    print(f"{nb_files} files, {nb_orphans} orphans: " + ", ".join(f"{ext or 'no extension'}: {count}" for ext, count in extensions.most_common()))
+    if decode:
+        print(f"{nb_images} images decoded, {nb_broken} broken")
+    print(f"{nb_tmp} unfinished downloads, {nb_blobs} unused blobs")
+    nb_problems = nb_dangling + nb_orphans + nb_broken + nb_tmp + nb_blobs
+    if nb_problems and not gc:
+        print("Run with --gc to remove them")
+    elif gc:
+        print(f"Removed {nb_problems} entries and files")
+    return nb_problems
+
+def hash_cache_images(cache, workers):
+    """Perceptual hash of the images of the index. HEIC files are left out, their JPEG conversion is hashed"""
+    def image_paths():
+        for entry in os.scandir(cache.images_dir):
+            name = entry.name.lower()
+            if entry.is_file() and name.endswith(IMAGE_EXTENSIONS) and not name.endswith(('.heic', '.heif')) \
+                    and cache.is_file_in_cache(entry.name):
+                yield entry.path
+
+    print(f"Hashing the images of {cache.images_dir}")
+    hashes = []
+    next_progress = PROGRESS_EVERY
+    for nb_files, batch in check_files(image_paths(), workers, hash_images):
+        hashes.extend(batch)
+        if len(hashes) >= next_progress:
+            print(f"Hashed {len(hashes)} images")
+            next_progress += PROGRESS_EVERY
+    return hashes
+
+def is_similar(a, b, max_distance):
+    """Same kind of file, hashes at most max_distance bits apart, same aspect ratio and same colours"""
+    path_a, hash_a, width_a, height_a, thumbnail_a = a
+    path_b, hash_b, width_b, height_b, thumbnail_b = b
+    kind_a = os.path.splitext(path_a)[1].lower()
+    kind_b = os.path.splitext(path_b)[1].lower()
+    if IMAGE_KINDS.get(kind_a, kind_a) != IMAGE_KINDS.get(kind_b, kind_b):
+        return False
+    if bin(hash_a ^ hash_b).count('1') > max_distance:
+        return False
+    ratio_a = width_a / height_a
+    ratio_b = width_b / height_b
+    if abs(ratio_a - ratio_b) > MAX_RATIO_DIFFERENCE * max(ratio_a, ratio_b):
+        return False
+    difference = sum(abs(x - y) for x, y in zip(thumbnail_a, thumbnail_b)) / len(thumbnail_a)
+    return difference <= MAX_COLOUR_DIFFERENCE
+
+def find_similar(hashes, max_distance):
+    """Groups of similar images, from the result of hash_cache_images.
+    The hashes are split in max_distance + 1 chunks: two hashes at most max_distance bits apart are equal on one chunk at least,
+    so only the images sharing a chunk are compared"""
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    nb_chunks = max_distance + 1
+    chunk_bits = -(-HASH_BITS // nb_chunks)
+    mask = (1 << chunk_bits) - 1
+    for chunk in range(nb_chunks):
+        buckets = defaultdict(list)
+        for i, item in enumerate(hashes):
+            buckets[(item[1] >> (chunk * chunk_bits)) & mask].append(i)
+        for bucket in buckets.values():
+            for a, b in itertools.combinations(bucket, 2):
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b and is_similar(hashes[a], hashes[b], max_distance):
+                    parent[root_a] = root_b
+
+    groups = defaultdict(list)
+    for i, item in enumerate(hashes):
+        groups[find(i)].append(item)
+    return [group for group in groups.values() if len(group) > 1]
+
+def collapse_similar(cache, groups, md_dir, dry_run):
+    """Keep the largest image of each group, the other files of the group become links to its blob.
+    The index is not changed: the urls keep their filename, which now has the content of the image kept.
+    Post images linked to a replaced file are linked again, then the blobs no longer used are removed.
+    Returns the number of replaced files and the number of bytes freed"""
+    # (device, inode) of a replaced file -> path of the image kept
+    replaced = {}
+    old_blobs = []
+    for group in groups:
+        # largest resolution, then largest file
+        group.sort(key=lambda item: (-item[2] * item[3], -os.path.getsize(item[0]), item[0]))
+        kept = group[0][0]
+        for file_path, _, width, height, _ in group[1:]:
+            if os.path.samefile(file_path, kept):
+                continue
+            print(f"Similar image: {os.path.basename(file_path)} ({width}x{height}) -> {os.path.basename(kept)} ({group[0][2]}x{group[0][3]})")
+            if dry_run:
+                continue
+            stat = os.stat(file_path)
+            replaced[(stat.st_dev, stat.st_ino)] = kept
+            old_blobs.append(cache.get_blob_path(hash_file(file_path)))
+            link_file(kept, file_path)
+
+    if replaced and os.path.isdir(md_dir):
+        print(f"Linking the images of the posts of {md_dir}")
+        for root, dirs, files in os.walk(md_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                stat = os.stat(file_path)
+                if (stat.st_dev, stat.st_ino) in replaced:
+                    link_file(replaced[(stat.st_dev, stat.st_ino)], file_path)
+
+    nb_bytes = 0
+    for blob_path in old_blobs:
+        # still linked from somewhere else, e.g. html/assets/images until the next generation
+        if os.path.isfile(blob_path) and os.stat(blob_path).st_nlink == 1:
+            nb_bytes += os.path.getsize(blob_path)
+            os.remove(blob_path)
+    return len(replaced), nb_bytes
+
+def dedup(cache, workers=None, max_distance=4, md_dir="md", dry_run=False):
+    hashes = hash_cache_images(cache, workers)
+    groups = find_similar(hashes, max_distance)
+    print(f"Found {len(groups)} groups of similar images among {len(hashes)} images")
+    nb_replaced, nb_bytes = collapse_similar(cache, groups, md_dir, dry_run)
+    if dry_run:
+        print("Dry run, nothing was modified")
+    else:
+        print(f"Replaced {nb_replaced} images by the largest similar image, freed {nb_bytes / 1024 / 1024:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--cache_dir", default="cache", help="cache directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("blobs", help="move images downloaded by an older version to the blob store")
+    heic_parser = subparsers.add_parser("heic", help="convert the HEIC images of the cache to JPEG")
+    heic_parser.add_argument("-w", "--workers", type=int, help="number of conversion processes, one per core by default")
+    fsck_parser = subparsers.add_parser("fsck", help="check the index and the images of the cache")
+    fsck_parser.add_argument("-w", "--workers", type=int, help="number of decoding processes, one per core by default")
+    fsck_parser.add_argument("--gc", action="store_true", help="remove dangling entries, orphan files, broken images and unused blobs")
+    fsck_parser.add_argument("--no_decode", action="store_true", help="only check the index and the files, without decoding the images")
+    dedup_parser = subparsers.add_parser("dedup", help="find the images which look the same, and keep the largest one")
+    dedup_parser.add_argument("-w", "--workers", type=int, help="number of hashing processes, one per core by default")
+    dedup_parser.add_argument("-d", "--distance", type=int, default=4, help=f"maximum number of different bits of the {HASH_BITS} bits perceptual hashes (default 4)")
+    dedup_parser.add_argument("--md_dir", default="md", help="md directory, its images are linked to the images kept")
+    dedup_parser.add_argument("--dry_run", action="store_true", help="only print the similar images")
+    args = parser.parse_args()
+
+    cache = Cache(cache_dir=args.cache_dir)
+    if args.command == "blobs":
+        store_blobs(cache)
+    elif args.command == "heic":
+        convert_heic(cache, args.workers)
+    elif args.command == "fsck":
+        if fsck(cache, args.workers, args.gc, not args.no_decode) and not args.gc:
+            sys.exit(1)
+    elif args.command == "dedup":
+        dedup(cache, args.workers, args.distance, args.md_dir, args.dry_run)
+
+if __name__ == "__main__":
+    main()
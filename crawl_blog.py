@@ -3,9 +3,12 @@ import requests
 from bs4 import BeautifulSoup
 import markdownify
 import urllib.request, urllib.parse, urllib.error
-import re, os, sys,argparse
+import re, os, sys,argparse,json
 
 from dotenv import load_dotenv
+from utils.util_feed import get_feed_posts, get_new_feed_posts
+from utils.http_client import get_client, configure
+from utils.util_parse import parse_post_page
 
 """
 Get all posts urls from a blog page
@@ -37,8 +40,8 @@ def get_first_post_url():
     urls, nextpage = get_posts_url_from_page(blog_url)
 
     for url in urls:
-        page = requests.get(url)
-        soup = BeautifulSoup(page.content, 'html.parser')
+        page = get_client().get(url)
+        soup = parse_post_page(page.content)
         previous_page = soup.find_all(class_='blog-pager-newer-link')
         if not previous_page:
             print(f"found first post: {url}")
@@ -51,8 +54,8 @@ def get_first_post_url():
 # Returns all posts urls, and the next page blog as a tuple
 # [url1, url2, ...], next_page_url
 def get_posts_url_from_page(url):
-    page = requests.get(url)
-    soup = BeautifulSoup(page.content, 'html.parser')
+    page = get_client().get(url)
+    soup = parse_post_page(page.content)
     title = soup.title.text # gets you the text of the <title>(...)</title>
     print(f"url: {url}")
 
@@ -71,22 +74,107 @@ def get_posts_url_from_page(url):
         nextpage = nextpage[0]["href"]
     return hrefs, nextpage
 
-def get_ordered_posts(firstpost_url,max=None):
-    posts = []
+def get_ordered_posts(firstpost_url,max=None,known=None,posts=None,checkpoint=None):
+    """Follow the older post links, starting from firstpost_url.
+    Stops before the first url found in known. Every 10 posts, and when max posts were crawled, checkpoint(posts, nextpost) is called,
+    crawling can be resumed by calling get_ordered_posts(nextpost, posts=posts)"""
+    if posts is None:
+        posts = []
     nextpost = firstpost_url
 
     while nextpost and (max ==None or max >0):
+        if known is not None and nextpost in known:
+            print(f"Reached known post {nextpost}")
+            break
         if max != None:
             max = max -1
         if len(posts) % 10 == 0:
             print(f"{len(posts)=}, {nextpost=}")
         posts.append(nextpost)
-        soup = BeautifulSoup(requests.get(nextpost).text, 'html.parser')
+        soup = parse_post_page(get_client().get(nextpost).content)
         nextpost = soup.find_all(class_='blog-pager-older-link')
         if nextpost:
             nextpost = nextpost[0]["href"]
+        if checkpoint and len(posts) % 10 == 0:
+            checkpoint(posts, nextpost)
+    if checkpoint and nextpost and max == 0:
+        checkpoint(posts, nextpost)
     return posts
 
+def load_checkpoint(checkpoint_file, mode):
+    try:
+        with open(checkpoint_file, 'r') as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if state.get("mode") != mode:
+        return None
+    return state
+
+def save_checkpoint(checkpoint_file, mode, posts, nextpost):
+    tmp_file = checkpoint_file + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({"mode": mode, "posts": posts, "next": nextpost}, f)
+    os.replace(tmp_file, checkpoint_file)
+
+def update_urls_file(output, max_posts, first_post_url=None, blog_url=None):
+    """Incremental crawl : only new posts, newer than the first url of output, are crawled and prepended to output.
+    Progress is saved in output.partial so an interrupted crawl resumes where it stopped.
+    max_posts is the number of posts crawled by this run: output is only updated once the crawl reaches a known post,
+    until then the next runs resume from output.partial, so no post between the new ones and the known ones is skipped"""
+    known_posts = []
+    if os.path.exists(output):
+        known_posts = [url for url in get_urls_from_file(output) if url]
+    known = set(known_posts)
+    print(f"Known posts: {len(known_posts)}")
+
+    checkpoint_file = output + ".partial"
+    mode = "feed" if blog_url else "pager"
+    state = load_checkpoint(checkpoint_file, mode)
+    if state:
+        print(f"Resuming crawl: {len(state['posts'])} new posts, next {state['next']}")
+    checkpoint = lambda posts, nextpost: save_checkpoint(checkpoint_file, mode, posts, nextpost)
+
+    new_posts = None
+    if blog_url:
+        start_index = state["next"] if state else 1
+        posts = state["posts"] if state else []
+        nb_resumed = len(posts)
+        try:
+            new_posts = get_new_feed_posts(blog_url, known, max_posts, start_index, posts, checkpoint=checkpoint)
+        except Exception as e:
+            print(f"Could not read feed: {e}")
+            print("Falling back to pager links")
+            state = load_checkpoint(checkpoint_file, "pager")
+            mode = "pager"
+    if new_posts is None:
+        if state:
+            posts = state["posts"]
+            nextpost = state["next"]
+        else:
+            posts = []
+            nextpost = resolve_first_post_url(first_post_url)
+        nb_resumed = len(posts)
+        new_posts = get_ordered_posts(nextpost, max_posts, known, posts, checkpoint)
+
+    if max_posts is not None and len(new_posts) - nb_resumed >= max_posts:
+        print(f"Crawled {max_posts} posts, {len(new_posts)} new posts so far: {output} is updated once a known post is reached, "
+              f"run again to resume from {checkpoint_file}")
+        return
+    print(f"New posts: {len(new_posts)}")
+    tmp_file = output + ".tmp"
+    with open(tmp_file, "w") as f:
+        for post in new_posts + known_posts:
+            f.write(post + "\n")
+    os.replace(tmp_file, output)
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+def get_urls_from_file(file_path):
+    with open(file_path, 'r') as f:
+        urls = f.read().splitlines()
+    return urls
+
 def main():
     # default values
     output = "all_urls.txt"
@@ -95,9 +183,17 @@ def main():
     load_dotenv()
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--first_post_url", help="url of the first post")
-    parser.add_argument("-m", "--max_posts", type=int, help="maximum number of posts to crawl")
+    parser.add_argument("-m", "--max_posts", type=int, help="maximum number of posts to crawl. With -i, the number of posts crawled by each run: "
+                        "the new posts are added to the output file once the crawl reaches a known post, the next runs resume from OUTPUT.partial")
     parser.add_argument("-o", "--output", help="output file")
+    parser.add_argument("-b", "--blog_url", help="url of the blog, used to read the feed")
+    parser.add_argument("--feed", action="store_true", help="discover posts from the blog feed instead of following the pager links")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="number of feed pages fetched concurrently")
+    parser.add_argument("-i", "--incremental", action="store_true", help="only crawl posts newer than the ones already in the output file")
+    parser.add_argument("--timeout", type=float, default=60, help="http timeout in seconds")
+    parser.add_argument("--retries", type=int, default=4, help="number of retries on http errors")
     args = parser.parse_args()
+    configure(timeout=args.timeout, retries=args.retries, max_per_host=max(8, args.workers))
 
     if args.first_post_url:
         first_post_url = args.first_post_url
@@ -110,6 +206,47 @@ def main():
     if args.output:
         output = args.output
 
+    blog_url = None
+    if args.feed:
+        blog_url = args.blog_url or os.getenv("blog_url")
+        if not blog_url:
+            print("blog_url not provided")
+            sys.exit(1)
+
+    if args.incremental:
+        print(f"Updating {output}")
+        update_urls_file(output, max_posts, first_post_url, blog_url)
+        get_client().report()
+        return
+
+    posts = None
+    if blog_url:
+        print(f"Reading feed of {blog_url} with max {max_posts}")
+        try:
+            posts = get_feed_posts(blog_url, max_posts, workers=args.workers)
+        except Exception as e:
+            print(f"Could not read feed: {e}")
+        if not posts:
+            print("Falling back to pager links")
+            posts = None
+
+    if posts is None:
+        posts = crawl_pager(first_post_url, max_posts)
+    print(f"Crawled : {len(posts)}")
+
+    print(f"output file {output}")
+    # write all urls to a file
+    with open(output, "w") as f:
+        for post in posts:
+            f.write(post + "\n")
+    get_client().report()
+
+def crawl_pager(first_post_url, max_posts):
+    first_post_url = resolve_first_post_url(first_post_url)
+    print(f"Crawling from {first_post_url} with max {max_posts}")
+    return get_ordered_posts(first_post_url,max_posts)
+
+def resolve_first_post_url(first_post_url=None):
     if not first_post_url:
         first_post_url = os.getenv("first_post_url")
         if not first_post_url:
@@ -118,16 +255,7 @@ def main():
             if not first_post_url:
                 print("Could not find first post url")
                 sys.exit(1)
-
-    print(f"output file {output}")
-    print(f"Crawling from {first_post_url} with max {max_posts}")
-    posts = get_ordered_posts(first_post_url,max_posts)
-    print(f"Crawled : {len(posts)}")
-
-    # write all urls to a file
-    with open(output, "w") as f:
-        for post in posts:
-            f.write(post + "\n")
+    return first_post_url
 
 
 
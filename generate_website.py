@@ -1,18 +1,36 @@
 import os
+import math
 import shutil
-from utils.generate_articles import generate_html_article
-from utils.generate_collections import generate_collection_pages
-from utils.generate_index import generate_index_pages
-from utils.generate_util import clean_and_create_dirs,get_sorted_articles
+import argparse
+import itertools
+from collections import deque
+from utils.generate_articles import get_article_paths, get_article_images
+from utils.generate_collections import generate_collection_page, generate_collection_index
+from utils.generate_index import generate_index_page, get_index_page_file
+from utils.generate_util import clean_and_create_dirs,find_article_files
+from utils.generate_jobs import start_jobs, map_jobs, load_article_job, generate_article_job
+from utils.generate_build import BuildManifest, ArticleIndex, hash_inputs, get_generator_version, get_files_inputs
+from utils.util_archive import Archive
 import locale
 
-def create_website(theme="black", loc='fr_FR.UTF-8'):
+# articles shown on each index page
+ARTICLES_PER_PAGE = 5
+
+def create_website(theme="black", loc='fr_FR.UTF-8', archive_path=None, incremental=False, md_dir='md', html_dir='html', jobs=1,
+                   render_cache_dir=os.path.join('cache', 'render'), index_path=os.path.join('cache', 'articles.db')):
     print("Creating website...")
     print("Theme: ", theme)
     print("Locale: ", loc)
+    print("Incremental: ", incremental)
+    print("Jobs: ", jobs)
+    print("Render cache: ", render_cache_dir)
+    print("Article index: ", index_path)
+    # posts and images are read from the backup archive, without extracting it
+    archive = None
+    if archive_path:
+        print("Archive: ", archive_path)
+        archive = Archive(archive_path)
 
-    md_dir = 'md'
-    html_dir = 'html'
     assets_dir = os.path.join(html_dir,'assets')
     css_dir = os.path.join(assets_dir, 'css')
     img_dir = os.path.join(assets_dir, 'images')
@@ -27,15 +45,26 @@ def create_website(theme="black", loc='fr_FR.UTF-8'):
         'img_dir': img_dir,
         'articles_dir': articles_dir,
         'collections_dir': collections_dir,
-        'theme': theme
+        'theme': theme,
+        'archive': archive
     }
     # Set locale to French
     # used to display date in french format, e.g. : month will be displayed as "janvier"
     locale.setlocale(locale.LC_TIME, loc)
 
     all_dirs = [html_dir, assets_dir, css_dir, img_dir, articles_dir, collections_dir]
-    # Clean up the output directory
-    clean_and_create_dirs(all_dirs)
+    # inputs of the pages of the last build, an incremental build only generates the pages whose inputs changed
+    manifest = BuildManifest(html_dir)
+    version = hash_inputs([get_generator_version(), theme, loc])
+    if not incremental or manifest.version != version:
+        if incremental:
+            print("No previous build with this generator and these settings, generating the whole website")
+        # Clean up the output directory
+        clean_and_create_dirs(all_dirs)
+        manifest.reset(version)
+    else:
+        for dir_path in all_dirs:
+            os.makedirs(dir_path, exist_ok=True)
 
     # copy CSS assets
     css_files = ['article-black.css','index-black.css','article-white.css','index-white.css']
@@ -45,35 +74,135 @@ def create_website(theme="black", loc='fr_FR.UTF-8'):
     # copy about.html
     shutil.copy2("assets/about.html", html_dir)
 
-    articles = get_sorted_articles(md_dir)
-    print(f"Found {len(articles)} articles.")
+    # metadata of the articles, the files which did not change are not read
+    article_index = ArticleIndex(index_path)
+    # articles are read and rendered in a pool of jobs processes
+    # the html rendered from the markdown is kept in render_cache_dir between builds
+    executor = start_jobs(configuration, archive_path, loc, jobs, render_cache_dir)
+    try:
+        generated = generate_pages(articles_dir, collections_dir, configuration, manifest, article_index, executor)
+    finally:
+        if executor:
+            executor.shutdown()
+    nb_generated, nb_up_to_date, (render_hits, render_misses) = generated
+
+    nb_removed = manifest.remove_stale()
+    manifest.save()
+    manifest.close()
+    article_index.save()
+    article_index.close()
+    print(f"Generated {nb_generated} pages, {nb_up_to_date} pages up to date, removed {nb_removed} files")
+    if render_cache_dir:
+        print(f"Render cache: {render_hits} hits, {render_misses} misses")
+
+    if archive:
+        archive.close()
+    print("Website generated successfully!")
 
-    alltags = set()
-    for article in articles:
-        # article['date'] is a datetime object, get year
-        year = article['date'].year
-        alltags.add(f"{year}-{article['tags']}")
+def generate_pages(articles_dir, collections_dir, configuration, manifest, article_index, executor=None):
+    """Generate the pages whose inputs changed since the build recorded in manifest,
+    the articles whose file did not change since the build recorded in article_index are read only if their page is generated.
+    The articles are read from article_index one at a time, and written one at a time.
+    Returns the number of generated pages and the number of pages up to date"""
+    archive = configuration['archive']
+    # Step 0: update the index of the articles
+    load_args = ((root, file, article_index.get(os.path.join(root, file))) for root, file in find_article_files(configuration['md_dir'], archive))
+    for article in map_jobs(executor, load_article_job, load_args, chunksize=64):
+        article_index.add(article)
+    article_index.remove_unseen()
+    nb_articles = article_index.count()
+    print(f"Found {nb_articles} articles.")
+    collections = article_index.get_collections()
+
+    nb_generated = 0
+    nb_up_to_date = 0
 
     # Step 1: Generate individual HTML articles
     # articles are sorted
     # iterate though articles, get current, previous and next article
-    for prev_article, article, next_article in zip([None] + articles[:-1], articles, articles[1:] + [None]):
-        prev_link = "" 
-        next_link = ""
-        if prev_article:
-            prev_link = prev_article['link']
-        if next_article:
-            next_link = next_article['link']
-        generate_html_article(article, configuration, prev_link, next_link)
+    # manifest entries of the articles being generated, in the order of the jobs
+    pending = deque()
+    def changed_articles():
+        nonlocal nb_up_to_date
+        articles = article_index.iter_articles()
+        prev_article = None
+        article = next(articles, None)
+        while article:
+            next_article = next(articles, None)
+            prev_link = "" 
+            next_link = ""
+            if prev_article:
+                prev_link = prev_article['link']
+            if next_article:
+                next_link = next_article['link']
+            article_file_path = get_article_paths(article, configuration)[1]
+            images = get_article_images(article, configuration)
+            inputs = hash_inputs([article['file_path'], article['hash'], prev_link, next_link, get_files_inputs(images, archive)])
+            image_files = [new_img_path for _, new_img_path in images]
+            if manifest.is_up_to_date(article_file_path, inputs):
+                nb_up_to_date += 1
+                # the index pages show the excerpt of the article computed when its page was generated
+                manifest.add(article_file_path, inputs, image_files, manifest.get_excerpt(article_file_path))
+            else:
+                pending.append((article_file_path, inputs, image_files))
+                yield article, prev_link, next_link
+            prev_article, article = article, next_article
 
+    # hits and misses of the render cache
+    render_stats = [0, 0]
+    # the articles are read, rendered and written one by one, their excerpt is kept in the manifest
+    for excerpt, hits, misses in map_jobs(executor, generate_article_job, changed_articles()):
+        article_file_path, inputs, image_files = pending.popleft()
+        manifest.add(article_file_path, inputs, image_files, excerpt)
+        render_stats[0] += hits
+        render_stats[1] += misses
+        nb_generated += 1
 
     # Step 3: Generate collection pages
-    generate_collection_pages(articles, configuration, sorted(list(alltags)))
+    for collection in collections:
+        collection_articles = list(article_index.iter_articles(collection))
+        collection_file_path = os.path.join(collections_dir, f"{collection}.html")
+        inputs = hash_inputs([collection, [(article['link'], article['title']) for article in collection_articles]])
+        if manifest.is_up_to_date(collection_file_path, inputs):
+            nb_up_to_date += 1
+        else:
+            generate_collection_page(collection, collection_articles, configuration)
+            nb_generated += 1
+        manifest.add(collection_file_path, inputs)
+    if collections:
+        index_file_path = os.path.join(collections_dir, 'index.html')
+        inputs = hash_inputs(collections)
+        if manifest.is_up_to_date(index_file_path, inputs):
+            nb_up_to_date += 1
+        else:
+            generate_collection_index(configuration, collections)
+            nb_generated += 1
+        manifest.add(index_file_path, inputs)
 
     # Step 4: Generate the index page
-    generate_index_pages(articles, configuration,sorted(list(alltags)))
-
-    print("Website generated successfully!")
+    total_pages = math.ceil(nb_articles / ARTICLES_PER_PAGE)
+    articles = article_index.iter_articles()
+    for page_num in range(1, total_pages + 1):
+        page_articles = list(itertools.islice(articles, ARTICLES_PER_PAGE))
+        page_file = get_index_page_file(configuration, page_num)
+        inputs = hash_inputs([page_num, total_pages, collections, [(article['file_path'], article['hash']) for article in page_articles]])
+        if manifest.is_up_to_date(page_file, inputs):
+            nb_up_to_date += 1
+        else:
+            for article in page_articles:
+                article['excerpt'] = manifest.get_excerpt(get_article_paths(article, configuration)[1])
+            generate_index_page(page_articles, configuration, collections, page_num, total_pages)
+            nb_generated += 1
+        manifest.add(page_file, inputs)
+    return nb_generated, nb_up_to_date, render_stats
 
 if __name__ == "__main__":
-    create_website()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-a", "--archive", help="read the posts and images from a backup made by archive.py export, instead of md/")
+    parser.add_argument("-i", "--incremental", action="store_true", help="only generate the pages whose posts, images or neighbours changed since the last build")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of processes rendering the articles, one per core with -j 0")
+    parser.add_argument("-r", "--render_cache", default=os.path.join('cache', 'render'), help="directory of the html rendered from the markdown, kept between builds. Empty to always render the markdown")
+    parser.add_argument("--index", default=os.path.join('cache', 'articles.db'), help="metadata of the articles, kept between builds to list them without reading the unchanged files")
+    args = parser.parse_args()
+    create_website(archive_path=args.archive, incremental=args.incremental, jobs=args.jobs or os.cpu_count() or 1,
+                   render_cache_dir=args.render_cache or None, index_path=args.index)
\ No newline at end of file
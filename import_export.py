@@ -0,0 +1,204 @@
+# convert a blogger export (Atom xml file) to markdown, without fetching the blog pages
+import markdownify
+import xml.etree.ElementTree as ET
+import os, sys, argparse, sqlite3, tempfile, datetime
+from bs4 import BeautifulSoup
+
+from dotenv import load_dotenv
+from scrapblog import format_metadata, format_comments, format_comments_html, get_content_hash, save_post
+from utils.util_parse import clean_post_html
+from utils.util_scrap import Cache, Manifest, ImageFetcher
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+APP = "{http://purl.org/atom/app#}"
+THR = "{http://purl.org/syndication/thread/1.0}"
+# namespace of the export format of blogger takeout
+BLOGGER = "{http://schemas.google.com/blogger/2018}"
+KIND_SCHEME = "http://schemas.google.com/g/2005#kind"
+
+DAYS = ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]
+MONTHS = ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août", "septembre", "octobre", "novembre", "décembre"]
+
+def get_local_date(date):
+    """Date as displayed in the blog date header, e.g. 'lundi 10 juillet 2023'"""
+    return f"{DAYS[date.weekday()]} {date.day} {MONTHS[date.month - 1]} {date.year}"
+
+def get_comment_timestamp(date):
+    """Date as displayed in the blog comment footer, e.g. '10 juillet 2023 à 14:52'"""
+    return f"{date.day} {MONTHS[date.month - 1]} {date.year} à {date.hour:02d}:{date.minute:02d}"
+
+def parse_date(text):
+    # the date keeps the timezone of the blog, e.g. 2023-07-10T14:52:00.000+02:00
+    return datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+
+def get_text(entry, tag):
+    element = entry.find(tag)
+    if element is None or element.text is None:
+        return ""
+    return element.text
+
+def get_kind(entry):
+    """'post', 'comment' or None for the other entries (settings, template, pages)"""
+    for category in entry.findall(ATOM + "category"):
+        if category.get("scheme") == KIND_SCHEME:
+            return category.get("term", "").split("#")[-1] or None
+    blogger_type = get_text(entry, BLOGGER + "type")
+    if blogger_type:
+        return blogger_type.lower()
+    return None
+
+def is_draft(entry):
+    control = entry.find(APP + "control")
+    if control is not None and get_text(control, APP + "draft") == "yes":
+        return True
+    status = get_text(entry, BLOGGER + "status")
+    return status not in ("", "LIVE")
+
+def get_post_url(entry, blog_url):
+    for link in entry.findall(ATOM + "link"):
+        if link.get("rel") == "alternate":
+            return link.get("href")
+    filename = get_text(entry, BLOGGER + "filename")
+    if filename and blog_url:
+        return blog_url.rstrip("/") + filename
+    return None
+
+def get_parent_id(entry):
+    reply = entry.find(THR + "in-reply-to")
+    if reply is not None:
+        return reply.get("ref")
+    return get_text(entry, BLOGGER + "parent")
+
+def get_author(entry):
+    author = entry.find(ATOM + "author")
+    if author is None:
+        return ""
+    return get_text(author, ATOM + "name").strip()
+
+def iter_entries(export_file):
+    """Yields the entries of the export one at a time, each entry is freed once processed"""
+    root = None
+    for event, element in ET.iterparse(export_file, events=("start", "end")):
+        if root is None:
+            root = element
+        elif event == "end" and element.tag == ATOM + "entry":
+            yield element
+            # entries are children of the root feed, drop them to keep memory constant
+            root.clear()
+
+def stage_export(export_file, db, blog_url):
+    """Read the export in a single streaming pass, and store posts and comments in the staging database.
+    Returns the number of posts and comments"""
+    # published keeps the timezone of the blog, entries are sorted on published_utc:
+    # the offset changes with daylight saving time, the iso strings are not in chronological order
+    db.execute("CREATE TABLE posts (id TEXT PRIMARY KEY, url TEXT, published TEXT, published_utc REAL, updated TEXT, title TEXT, content TEXT)")
+    db.execute("CREATE TABLE comments (post_id TEXT, published TEXT, published_utc REAL, author TEXT, content TEXT)")
+    db.execute("CREATE INDEX comments_post ON comments (post_id, published_utc)")
+    nb_posts = 0
+    nb_comments = 0
+    for entry in iter_entries(export_file):
+        kind = get_kind(entry)
+        if kind not in ("post", "comment") or is_draft(entry):
+            continue
+        entry_id = get_text(entry, ATOM + "id")
+        published_date = parse_date(get_text(entry, ATOM + "published"))
+        published = published_date.isoformat()
+        published_utc = published_date.timestamp()
+        content = get_text(entry, ATOM + "content")
+        if kind == "post":
+            url = get_post_url(entry, blog_url)
+            if not url:
+                continue
+            db.execute("INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (entry_id, url, published, published_utc, get_text(entry, ATOM + "updated") or None,
+                        get_text(entry, ATOM + "title").strip(), content))
+            nb_posts += 1
+        else:
+            db.execute("INSERT INTO comments VALUES (?, ?, ?, ?, ?)", (get_parent_id(entry), published, published_utc, get_author(entry), content))
+            nb_comments += 1
+    db.commit()
+    return nb_posts, nb_comments
+
+def build_post(db, post_id, url, published, updated, title, content, html=False):
+    """Same post dict as scrapblog.fetch_post. The hash is computed from the html of the export,
+    the sync mode of scrapblog.py rewrites the posts updated on the blog after the export"""
+    date = parse_date(published)
+    year, month, day = f"{date.year}", f"{date.month:02d}", f"{date.day:02d}"
+    metadata = format_metadata(title, get_local_date(date))
+    md_text = metadata + markdownify.markdownify(content)
+
+    comment_elements = []
+    comment_bodies = []
+    # comments are displayed from the oldest to the newest on the blog
+    for comment_published, author, body in db.execute(
+            "SELECT published, author, content FROM comments WHERE post_id = ? ORDER BY published_utc", (post_id,)):
+        comment_bodies.append(body)
+        body = BeautifulSoup(body, 'html.parser').get_text(strip=True)
+        comment_elements.append((author, body, get_comment_timestamp(parse_date(comment_published))))
+    md_text += format_comments(comment_elements)
+    html_text = None
+    if html:
+        html_text = metadata + clean_post_html(content) + format_comments_html(comment_elements)
+
+    return {
+        'url': url,
+        'year': year,
+        'month': month,
+        'day': day,
+        'filename': url.split('/')[-1].replace('.html', '.md'),
+        'md_text': md_text,
+        'html_text': html_text,
+        'hash': get_content_hash(content, "".join(comment_bodies)),
+        'updated': updated,
+    }
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("export_file", help="blogger export file (Atom xml)")
+    parser.add_argument("-t", "--target_directory", default="md", help="target directory where md files will be stored")
+    parser.add_argument("-b", "--blog_url", help="url of the blog, used when the export does not contain the post urls")
+    parser.add_argument("--image_workers", type=int, default=8, help="number of images downloaded concurrently")
+    parser.add_argument("--format", choices=["md", "html", "both"], default="md",
+                        help="save the posts as markdown (default), as sanitized html, or both")
+    args = parser.parse_args()
+    target_directory = args.target_directory
+    formats = ("md", "html") if args.format == "both" else (args.format,)
+    blog_url = args.blog_url or os.getenv("blog_url")
+
+    if not os.path.exists(target_directory):
+        os.makedirs(target_directory)
+        print(f"Created md directory: {target_directory}")
+
+    # posts are staged on disk so they can be written from the newest to the oldest, as scrapblog does,
+    # whatever the order of the export
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = sqlite3.connect(os.path.join(tmp_dir, "export.db"))
+        nb_posts, nb_comments = stage_export(args.export_file, db, blog_url)
+        print(f"Read {nb_posts} posts and {nb_comments} comments from {args.export_file}")
+
+        manifest = Manifest(target_directory)
+        fetcher = ImageFetcher(Cache(), workers=args.image_workers)
+        stats = dict()
+        nb_existing = 0
+        try:
+            # the cursor streams the posts, only one post is in memory at a time
+            for post_id, url, published, updated, title, content in db.execute(
+                    "SELECT id, url, published, updated, title, content FROM posts ORDER BY published_utc DESC"):
+                if manifest.is_saved(url):
+                    nb_existing += 1
+                    continue
+                post = build_post(db, post_id, url, published, updated, title, content, html="html" in formats)
+                if save_post(post, stats, mddir=target_directory, manifest=manifest, fetcher=fetcher, formats=formats):
+                    if len(stats) % 50 == 0:
+                        print(f"Imported {len(stats)} posts - last url: {url}")
+                else:
+                    nb_existing += 1
+        finally:
+            fetcher.shutdown()
+            db.close()
+
+    print(f"Imported {len(stats)} posts, skipped {nb_existing} existing posts")
+
+if __name__ == "__main__":
+    main()
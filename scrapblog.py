@@ -3,13 +3,20 @@ import requests
 from bs4 import BeautifulSoup
 import markdownify
 import urllib.request, urllib.parse, urllib.error
-import re, os, sys,argparse,json
+import re, os, sys,argparse,json,hashlib,html
 
 from dotenv import load_dotenv
-from utils.util_scrap import Cache, UrlChecker
-import shutil
-from PIL import Image
-import pyheif
+from utils.util_scrap import Cache, UrlChecker, Manifest, ImageFetcher, PageCache
+from utils.util_archive import Archive
+from utils.http_client import get_client, configure
+from utils.util_file import link_file
+from utils.metrics import metrics
+from utils.util_parse import parse_post_page, clean_post_html
+from utils.util_feed import get_updated_feed_posts, parse_feed_date
+import cProfile, pstats, threading
+import shutil, itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 def load_tags(file_path="tags.json"):
     try:
@@ -51,7 +58,27 @@ def main():
     parser.add_argument("-t", "--target_directory", help="target directory where md files will be stored")
     parser.add_argument("-f", "--urls_file", help="urls to scrap")
     parser.add_argument("-m", "--max_urls", type=int, help="maximum number of urls to scrap")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of posts fetched and parsed concurrently")
+    parser.add_argument("--image_workers", type=int, default=8, help="number of images downloaded concurrently")
+    parser.add_argument("--cache_pages", action="store_true", help="keep the html of the posts in the cache, and revalidate it on the next runs")
+    parser.add_argument("--offline", action="store_true", help="only use the posts and images already in the cache, no network access")
+    parser.add_argument("--force", action="store_true", help="rewrite the posts already saved")
+    parser.add_argument("--archive", help="backup made by archive.py export: images missing in the cache are taken from it, and with --offline the pages too")
+    parser.add_argument("--format", choices=["md", "html", "both"], default="md",
+                        help="save the posts as markdown (default), as sanitized html, or both")
+    parser.add_argument("--sync", nargs="?", const="pages", choices=["pages", "feed"],
+                        help="check the posts already saved and rewrite the edited ones: pages (default) revalidates every page, feed only checks the posts updated in the blog feed")
+    parser.add_argument("-b", "--blog_url", help="url of the blog, for --sync feed")
+    parser.add_argument("--metrics", help="write the timings of the run to this json file")
+    parser.add_argument("--profile", action="store_true", help="profile the main thread and the threads fetching the posts and images, the merged profile is saved in scrapblog.prof")
+    parser.add_argument("--timeout", type=float, default=60, help="http timeout in seconds")
+    parser.add_argument("--retries", type=int, default=4, help="number of retries on http errors")
     args = parser.parse_args()
+    configure(timeout=args.timeout, retries=args.retries, max_per_host=max(8, args.workers, args.image_workers))
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        thread_profiles = profile_threads()
     if args.target_directory:
         target_directory = args.target_directory
     else:
@@ -73,7 +100,17 @@ def main():
     print(f"Backuping: {urls_file}")
     print(f"target_directory: {target_directory}")
     print(f"max_urls: {max_urls}")
+    print(f"workers: {args.workers}")
     print(f"Using cache : {cache_dir}")
+    if args.archive:
+        print(f"Using archive : {args.archive}")
+    if args.sync and args.offline:
+        print("--sync needs network access, it can not be used with --offline")
+        sys.exit(1)
+    blog_url = args.blog_url or os.getenv("blog_url")
+    if args.sync == "feed" and not blog_url:
+        print("blog_url not found in .env file, and no --blog_url given")
+        sys.exit(1)
 
     # create a md directory if it doesn't exist
     if not os.path.exists(target_directory):
@@ -87,10 +124,57 @@ def main():
     stats = dict()
     nb_extracted = 0
     nb_existing = 0
+
+    # posts listed in the manifest are skipped without being downloaded
+    manifest = Manifest(target_directory)
+    updates = {}
+    if args.sync == "feed":
+        updates = get_sync_updates(blog_url, manifest)
+    new_urls = []
+    # saved posts checked for changes
+    sync_urls = set()
     for url in allurls:
-        if extract_post(url,stats,mddir=target_directory):
+        if manifest.is_saved(url) and not args.force:
+            if args.sync == "pages" or url in updates:
+                sync_urls.add(url)
+                new_urls.append(url)
+            else:
+                nb_existing += 1
+        else:
+            new_urls.append(url)
+    print(f"Skipped {nb_existing} urls already in the manifest")
+    if args.sync:
+        print(f"Checking {len(sync_urls)} saved posts for changes")
+
+    archive = Archive(args.archive) if args.archive else None
+    page_cache = None
+    if args.cache_pages or args.offline or args.sync == "pages":
+        page_cache = PageCache(cache_dir, offline=args.offline, archive=archive)
+    # images are downloaded in the background, but added to the cache in the order of the posts
+    fetcher = ImageFetcher(Cache(cache_dir), workers=args.image_workers, offline=args.offline, archive=archive)
+    # posts are fetched concurrently but saved in order, so directory prefixes stay deterministic
+    formats = ("md", "html") if args.format == "both" else (args.format,)
+    posts = fetch_posts(new_urls, args.workers, fetcher, page_cache, sync_urls, html="html" in formats)
+    nb_missing = 0
+    nb_changed = 0
+    for post in posts:
+        if post is None:
+            nb_missing += 1
+            continue
+        url = post['url']
+        force = args.force
+        if url in sync_urls:
+            post['updated'] = updates.get(url)
+            if not is_post_changed(post, manifest):
+                nb_missing += 1
+                continue
+            print(f"Post changed: {url}")
+            nb_changed += 1
+            force = True
+        if save_post(post,stats,mddir=target_directory,manifest=manifest,fetcher=fetcher,force=force,formats=formats):
             nb_extracted += 1
             if max_urls > 0 and nb_extracted >= max_urls:
+                posts.close()
                 break
             if nb_extracted % 2 == 0:
                 print(f"Processed {nb_extracted} urls - last url: {url}")
@@ -98,11 +182,71 @@ def main():
             nb_existing += 1
             if nb_existing % 10 == 0:
                 print(f"Skipped {nb_existing} urls - last url: {url}")
+    fetcher.shutdown()
+    if archive:
+        archive.close()
+    if args.sync:
+        print(f"Rewrote {nb_changed} changed posts, {nb_missing} posts unchanged")
+    elif nb_missing:
+        print(f"Skipped {nb_missing} urls not in the page cache")
+    if args.profile:
+        threading.setprofile(None)
+        profiler.disable()
+        # the worker threads are stopped, their profiles are complete
+        profile_stats = pstats.Stats(profiler)
+        for thread_profile in thread_profiles:
+            profile_stats.add(thread_profile)
+        profile_stats.dump_stats("scrapblog.prof")
+        print(f"Profile of the main thread and {len(thread_profiles)} worker threads saved in scrapblog.prof, hot paths:")
+        profile_stats.sort_stats("cumulative").print_stats(25)
     if stats:
         max_length = max(len(str(s)) for s in stats)
         for s in sorted(stats):
             print(f"{s:{max_length}d} : {stats[s]['date']} {stats[s]['path']}{stats[s]['filename']}")
 
+    metrics.report()
+    get_client().report()
+    metrics.set_section('hosts', get_client().get_stats())
+    if args.metrics:
+        metrics.save(args.metrics)
+        print(f"Metrics saved in {args.metrics}")
+
+def profile_threads():
+    """Profile each thread started from now on with its own cProfile.Profile, cProfile only sees the thread which enabled it.
+    Returns the list of the profiles of the threads, to merge with pstats.Stats.add"""
+    profiles = []
+    def start_profile(frame, event, arg):
+        # called on the first event of a new thread, the profile then replaces this function
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already active: since python 3.12 it sees every thread
+            sys.setprofile(None)
+            return
+        profiles.append(profile)
+    threading.setprofile(start_profile)
+    return profiles
+
+def get_sync_updates(blog_url, manifest):
+    """Update date of the posts updated in the feed since the last sync"""
+    updated_dates = [parse_feed_date(entry['updated']) for entry in manifest.posts.values() if entry.get('updated')]
+    since = max(updated_dates) if updated_dates else None
+    updates = get_updated_feed_posts(blog_url, since)
+    print(f"Feed reports {len(updates)} posts updated since {since or 'the first sync'}")
+    return updates
+
+def is_post_changed(post, manifest):
+    """Compare the hash of a fetched post with the hash recorded when it was saved.
+    A post saved without a hash (older versions) is unchanged, its hash is recorded for the next sync"""
+    entry = manifest.posts[post['url']]
+    if entry.get('hash') and entry['hash'] != post['hash']:
+        return True
+    if not entry.get('hash') or (post.get('updated') and entry.get('updated') != post['updated']):
+        # remember the hash and the update date, so the post is not checked again by the next feed sync
+        manifest.add(post['url'], entry['path'], post['hash'], post.get('updated') or entry.get('updated'))
+    return False
+
 def get_local_date(soup):
     date_entry = soup.find(class_='date-header')
     if date_entry:
@@ -122,12 +266,16 @@ def get_year_month_day(date_entry):
     return year, month, day
 
 def get_metadata(soup):
-    md_text = "---\n"
     # get post title
     title = soup.find('h3',class_='post-title')
     title = title.get_text(strip=True)
-    md_text += f"title: {title}\n"
     local_date = get_local_date(soup)
+    return format_metadata(title, local_date)
+
+def format_metadata(title, local_date):
+    """yaml front matter of a post, local_date is the date as displayed by the blog, e.g. 'lundi 10 juillet 2023'"""
+    md_text = "---\n"
+    md_text += f"title: {title}\n"
     md_text += f"date: {local_date}\n"
     year,month,day = get_year_month_day(local_date)
     alltags = load_tags()
@@ -143,40 +291,156 @@ def get_metadata(soup):
 
 
 
-def convert_heic_to_jpg(heic_file_path, jpg_file_path):
-    # Open the HEIC file using pyheif
-    heif_file = pyheif.read(heic_file_path)
-
-    # Convert the HEIC data to a Pillow image
-    image = Image.frombytes(
-        heif_file.mode, 
-        heif_file.size, 
-        heif_file.data,
-        "raw",
-        heif_file.mode,
-        heif_file.stride,
-    )
-
-    # Save the image as a JPG
-    image.save(jpg_file_path, "JPEG")
-
-
-
-def extract_post(url,stats,mddir="md"):
-    md_dir = mddir + "/"
+def fetch_post(url,fetcher=None,page_cache=None,only_modified=False,html=False):
+    """Download and parse a post, returns a dict with its date, filename and markdown text.
+    Does not touch the md directory, so it can run concurrently.
+    When a fetcher is given, the post images start downloading in the background.
+    With a page cache, the page is revalidated or read from the cache, None is returned if it is offline and not cached,
+    or with only_modified if the page did not change since it was cached"""
+    with metrics.stage("fetch"):
+        if page_cache is not None:
+            content = page_cache.get(url, only_modified=only_modified)
+            if content is None:
+                return None
+        else:
+            page = get_client().get(url)
+            content = page.content
+            metrics.add("bytes_pages", len(content))
+    with metrics.stage("parse"):
+        soup = parse_post_page(content)
+    return parse_post(url, soup, fetcher, html)
+
+def format_comments(comment_elements):
+    """Comments section of the markdown, from a list of (author, body, timestamp)"""
     # Start of comment block in markdown file
     START_COMMENT = "\n\nCommentaires:\n"
-    page = requests.get(url)
-    soup = BeautifulSoup(page.content, 'html.parser')
-    
-    md_text = get_metadata(soup)
-    year,month,day = get_year_month_day(get_local_date(soup))
+    if not comment_elements:
+        return ""
+    # add comments to the markdown, each comment followed by a line break
+    parts = [START_COMMENT]
+    for author, body, timestamp in comment_elements:
+        parts.append(f"\n{author} ({timestamp}):\n{body}\n\n")
+    return "".join(parts)
+
+def format_comments_html(comment_elements):
+    """Comments section of the html storage mode, the generator styles what follows <p>Commentaires:</p>"""
+    if not comment_elements:
+        return ""
+    parts = ["\n<p>Commentaires:</p>\n"]
+    for author, body, timestamp in comment_elements:
+        parts.append(f"<p>{html.escape(author)} ({html.escape(timestamp)}):<br>\n{html.escape(body)}</p>\n")
+    return "".join(parts)
+
+def get_content_hash(entry_content, comment_blocks):
+    """Hash of the html of a post and of its comments, recorded in the manifest to detect edited posts"""
+    return hashlib.sha256((str(entry_content) + str(comment_blocks)).encode()).hexdigest()
+
+def parse_post(url,soup,fetcher=None,html=False):
+    """Markdown of a post, and its sanitized html when html is set"""
+    with metrics.stage("metadata"):
+        # the markdown is assembled once, from its parts
+        parts = [get_metadata(soup)]
+        year,month,day = get_year_month_day(get_local_date(soup))
 
     # get the filename from the link
     filename = url.split('/')[-1]
-    # replace extension with .md
+    # replace extension with .md
     filename = filename.replace('.html', '.md')
 
+    # Get 'entry-content' from the html
+    entry_content = soup.find(class_='entry-content')
+
+    # entry_content is an html div
+    # convert it to markdown
+    # use a library like markdownify
+    with metrics.stage("markdownify"):
+        parts.append(markdownify.markdownify(entry_content.decode_contents()))
+
+    # get comment-author and comment-body that are in the same comment-block
+    
+    with metrics.stage("comments"):
+        # Find the dl element with the ID 'comment-blocks'
+        comment_blocks = soup.find('dl', {'id': 'comments-block'})
+        comment_elements= []
+        if comment_blocks:
+            # Iterate over the dt (comment-author) and dd (comment-body) elements
+        
+            author_elements = comment_blocks.find_all('dt',class_='comment-author')
+            body_elements = comment_blocks.find_all('dd',class_='comment-body')
+            date_elements = comment_blocks.find_all('dd',class_='comment-footer')
+            for aut, bd, ts in zip(author_elements,body_elements,date_elements):
+                author = aut.get_text(strip=True).replace('a dit…', '').rstrip()
+                body = bd.get_text(strip=True)
+                timestamp = ts.get_text(strip=True)
+                comment_elements.append((author, body,timestamp))
+
+            parts.append(format_comments(comment_elements))
+
+    md_text = "".join(parts)
+    html_text = None
+    if html:
+        with metrics.stage("clean_html"):
+            html_text = "".join([parts[0], clean_post_html(entry_content.decode_contents()), format_comments_html(comment_elements)])
+    if fetcher is not None:
+        for image_url in dict.fromkeys(get_image_urls(md_text)):
+            fetcher.prefetch(fetcher.get_image_key(image_url))
+
+    content_hash = get_content_hash(entry_content, comment_blocks)
+
+    return {
+        'url': url,
+        'year': year,
+        'month': month,
+        'day': day,
+        'filename': filename,
+        'md_text': md_text,
+        'html_text': html_text,
+        'hash': content_hash,
+    }
+
+def fetch_posts(urls, workers=1, fetcher=None, page_cache=None, only_modified=(), html=False):
+    """Yields fetched posts in the order of urls.
+    With workers > 1, up to 2*workers posts are fetched ahead in a thread pool.
+    Urls in only_modified are skipped (None is yielded) when their cached page did not change"""
+    if workers <= 1:
+        for url in urls:
+            yield fetch_post(url, fetcher, page_cache, url in only_modified, html)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    urls = iter(urls)
+    try:
+        for url in itertools.islice(urls, 2 * workers):
+            pending.append(executor.submit(fetch_post, url, fetcher, page_cache, url in only_modified, html))
+        while pending:
+            post = pending.popleft().result()
+            for url in itertools.islice(urls, 1):
+                pending.append(executor.submit(fetch_post, url, fetcher, page_cache, url in only_modified, html))
+            yield post
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def save_post(post,stats,mddir="md",manifest=None,fetcher=None,force=False,formats=("md",)):
+    """Write a fetched post and its images in the md directory, and record it in the manifest.
+    formats: "md" writes post.md, "html" writes the sanitized html in post.html, with the same front matter.
+    Returns False if the post was already saved, unless force is set : the post is then rewritten in its directory.
+    The XX- prefix depends on the directories already present, so posts must be saved one at a time, in order.
+    Without fetcher, the images are downloaded by a fetcher shut down once the post is saved"""
+    if fetcher is None:
+        fetcher = ImageFetcher(Cache())
+        try:
+            return save_post(post, stats, mddir, manifest, fetcher, force, formats)
+        finally:
+            fetcher.shutdown()
+    md_dir = mddir + "/"
+    url = post['url']
+    year, month, day = post['year'], post['month'], post['day']
+    filename = post['filename']
+    html_filename = filename.replace('.md', '.html')
+    md_text = post['md_text']
+    html_text = post.get('html_text')
+
     path = md_dir + "/".join([year,month,day]) + "/"
     if not os.path.exists(path):
         os.makedirs(path)
@@ -185,24 +449,38 @@ def extract_post(url,stats,mddir="md"):
     dirs = [entry for entry in entries if os.path.isdir(os.path.join(path, entry))]
     
     # check if we already have a directory ending with filename
+    existing_dir = None
     for d in dirs:
         if d.endswith(filename.replace('.md', '')):
+            if force:
+                existing_dir = d
+                break
+            # saved by a run without manifest, record it so it is not fetched again
+            for saved_file in (filename, html_filename):
+                if manifest is not None and os.path.isfile(os.path.join(path, d, saved_file)):
+                    manifest.add(url, os.path.relpath(os.path.join(path, d, saved_file), mddir))
+                    break
             return False
 
-    # Count the number of directories
-    num_dirs = len(dirs)
+    if existing_dir:
+        # rewrite the post in its directory, keeping its prefix
+        path = path + existing_dir + "/"
+        os.makedirs(path+"images/", exist_ok=True)
+    else:
+        # Count the number of directories
+        num_dirs = len(dirs)
 
-    # prefix filename with the number of files
-    dirname = str(num_dirs).zfill(2)+"-"+filename.replace('.md', '')+"/"
+        # prefix filename with the number of files
+        dirname = str(num_dirs).zfill(2)+"-"+filename.replace('.md', '')+"/"
     
-    # get url path and create directories
-    path = path + dirname
-    if not os.path.exists(path):
-        os.makedirs(path)
-        os.makedirs(path+"images/")
-    else:
-        print(f"File already exists: {path+dirname}")
-        return False
+        # get url path and create directories
+        path = path + dirname
+        if not os.path.exists(path):
+            os.makedirs(path)
+            os.makedirs(path+"images/")
+        else:
+            print(f"File already exists: {path+dirname}")
+            return False
     
     id = len(stats)
     stats[id] = {}
@@ -211,83 +489,133 @@ def extract_post(url,stats,mddir="md"):
     stats[id]['path'] = path
     stats[id]['filename'] = filename
 
+    # each image once, in order of first occurrence
+    urls = list(dict.fromkeys(get_image_urls(md_text)))
+    cache = fetcher.cache
+    # start downloading all images of the post
+    with metrics.stage("images"):
+        # the sizes and mirrors of a blogger image share one download, of the original image
+        keys = {url: fetcher.get_image_key(url) for url in urls}
+        for key in dict.fromkeys(keys.values()):
+            fetcher.prefetch(key)
+        image_names = {}
+        for url in urls:
+            key = keys[url]
+            image_name = ""
+            if cache.is_url_in_cache(key):
+                image_name = cache.get_filename(key)
+            else:
+                fetcher.add_file(key, get_image_name(key))
+                image_name = cache.get_filename(key)
+            if not image_name:
+                # offline, and the image was never downloaded : keep its url
+                print(f"Image not in cache: {url}")
+                continue
+            img_path = path + "images/" + image_name
+            # link image from cache to img_path
+            try:
+                link_file(cache.get_filepath(image_name), img_path)
+            except Exception as e:
+                print(f"Error copying {url}\n{cache.get_filepath(image_name)} --> {img_path}: {e}")
+            image_names[url] = image_name
+        # update markdown
+        md_text = rewrite_image_urls(md_text, image_names)
+        if html_text is not None:
+            # urls are escaped in the html attributes
+            html_names = {url.replace("&", "&amp;"): image_name for url, image_name in image_names.items()}
+            html_text = rewrite_image_urls(html_text, html_names, HTML_URL_REST)
 
-    # Get 'entry-content' from the html
-    entry_content = soup.find(class_='entry-content')
-
-    # entry_content is an html div
-    # convert it to markdown
-    # use a library like markdownify
-    md_text += markdownify.markdownify(entry_content.decode_contents())
+    # save the markdown to a file
+    with metrics.stage("write"):
+        if "md" in formats:
+            with open(path+filename, 'w') as f:
+                f.write(md_text)
+        if "html" in formats:
+            with open(path+html_filename, 'w') as f:
+                f.write(html_text)
+    metrics.add("posts")
+
+    if manifest is not None:
+        saved_file = filename if "md" in formats else html_filename
+        manifest.add(post['url'], os.path.relpath(path+saved_file, mddir), post.get('hash'), post.get('updated'))
+    return True  
 
-    # get comment-author and comment-body that are in the same comment-block
-    
-    # Find the dl element with the ID 'comment-blocks'
-    comment_blocks = soup.find('dl', {'id': 'comments-block'})
-    comment_elements= []
-    if comment_blocks:
-        # Iterate over the dt (comment-author) and dd (comment-body) elements
-        
-        author_elements = comment_blocks.find_all('dt',class_='comment-author')
-        body_elements = comment_blocks.find_all('dd',class_='comment-body')
-        date_elements = comment_blocks.find_all('dd',class_='comment-footer')
-        for aut, bd, ts in zip(author_elements,body_elements,date_elements):
-            author = aut.get_text(strip=True).replace('a dit…', '').rstrip()
-            body = bd.get_text(strip=True)
-            timestamp = ts.get_text(strip=True)
-            comment_elements.append((author, body,timestamp))
-
-        if comment_elements:
-            # add comments to the markdown
-            md_text += START_COMMENT
-            for author, body, timestamp in comment_elements:
-                md_text += f"\n{author} ({timestamp}):\n{body}\n"
-                # add a line break after each comment
-                md_text += "\n"
+def extract_post(url,stats,mddir="md"):
+    return save_post(fetch_post(url), stats, mddir)
 
-    
+def get_image_urls(md_text):
     # Regular expression pattern to match URLs starting with "https://" until we get to a )
     # notice the +? : which requires the match to be non greedy and stop at the first )
     pattern = r'(https?://[^\s]+?)\)'
 
     # Find all matches
-    urls = re.findall(pattern, md_text)
-    cache = Cache()
-    # Print the URLs
-    for url in urls:
-        image_name = ""
-        if cache.is_url_in_cache(url):
-            image_name = cache.get_filename(url)
+    return re.findall(pattern, md_text)
+
+# start of every url of the markdown, also inside another url, e.g. in the text of a link
+URL_START = re.compile(r'https?://')
+# rest of an url, up to the first space or closing parenthesis, which image urls do not contain
+URL_REST = re.compile(r'[^\s)]*')
+# rest of an url in an html attribute
+HTML_URL_REST = re.compile(r'[^\s)"\'<>]*')
+
+def rewrite_image_urls(md_text, image_names, url_rest=URL_REST):
+    """Replace the image urls of md_text by their path in the images directory, in a single pass.
+    image_names maps each url to its image name, in order of first occurrence.
+    When several urls start at the same position, e.g. an url and the same url with a query string,
+    the first one wins, as when each url was replaced one after the other"""
+    if not image_names:
+        return md_text
+    order = {url: i for i, url in enumerate(image_names)}
+    # longest url starting each url, if any : in sorted order, an url is followed by the urls it starts
+    parents = {}
+    stack = []
+    for url in sorted(image_names):
+        while stack and not url.startswith(stack[-1]):
+            stack.pop()
+        if stack:
+            parents[url] = stack[-1]
+        stack.append(url)
+    lengths = sorted({len(url) for url in image_names})
+    parts = []
+    end = 0
+    for match in URL_START.finditer(md_text):
+        start = match.start()
+        if start < end:
+            # inside an url already replaced
+            continue
+        token = md_text[start:url_rest.match(md_text, match.end()).end()]
+        if token in order:
+            candidates = [token]
+            while candidates[-1] in parents:
+                candidates.append(parents[candidates[-1]])
         else:
-            url_checker = UrlChecker(url)
-            if url.endswith('/'):
-                newurl = url[:-1]
-                image_name = newurl.split('/')[-1] + ".jpg"
-            # no extension assume it is a jpg
-            elif not url_checker.has_extension():
-                image_name = url.split('/')[-1] + ".jpg"
-            else:
-                image_name = url.split('/')[-1]
-            # some file names are really long, shorten them
-            if len(image_name) > 30:
-                # get last 30 characters
-                image_name = image_name[-30:]
-            cache.add_file(url, image_name)
-            image_name = cache.get_filename(url)
-        img_path = path + "images/" + image_name
-        # copy image from cache to img_path
-        try:
-            shutil.copy2(cache.get_filepath(image_name), img_path)
-        except Exception as e:
-            print(f"Error copying {url}\n{cache.get_filepath(image_name)} --> {img_path}: {e}")
-        # update markdown
-        md_text = md_text.replace(url, "images/" + image_name)
-
-    # save the markdown to a file
-    with open(path+filename, 'w') as f:
-        f.write(md_text)
-
-    return True  
+            # the url is followed by other characters, e.g. ']' in the text of a link
+            candidates = [token[:length] for length in lengths if length < len(token)]
+        candidates = [url for url in candidates if url in order]
+        if candidates:
+            url = min(candidates, key=order.get)
+            parts.append(md_text[end:start])
+            parts.append("images/" + image_names[url])
+            end = start + len(url)
+    parts.append(md_text[end:])
+    return "".join(parts)
+
+def get_image_name(url):
+    """Name of the image in the cache, before making it unique"""
+    url_checker = UrlChecker(url)
+    if url.endswith('/'):
+        newurl = url[:-1]
+        image_name = newurl.split('/')[-1] + ".jpg"
+    # no extension assume it is a jpg
+    elif not url_checker.has_extension():
+        image_name = url.split('/')[-1] + ".jpg"
+    else:
+        image_name = url.split('/')[-1]
+    # some file names are really long, shorten them
+    if len(image_name) > 30:
+        # get last 30 characters
+        image_name = image_name[-30:]
+    return image_name
 
 
 
@@ -0,0 +1,87 @@
+# Export a synthetic md directory and image cache with archive.py, import it, then rebuild its blob store
+# - checks that the imported files have the same content as the exported ones
+# - checks that cache.py blobs links every imported image to its blob, and that a second run links none
+# - measures the time of the export, of the import and of the blob store
+# usage : python -m utils.bench_archive [-n POSTS]
+import os, sys, time, argparse, tempfile
+
+from utils.util_archive import export_backup, import_backup
+from utils.util_scrap import Cache
+from utils.util_file import hash_file
+
+def write_blog(root_dir, nb_posts, nb_images=3):
+    """Posts with their images hardlinked to the image cache, as saved by scrapblog.py.
+    The last image of each post has the same content as the first image of the next post"""
+    cache = Cache(os.path.join(root_dir, "cache"))
+    for i in range(nb_posts):
+        post_dir = os.path.join(root_dir, "md", "2023", "07", f"{1 + i % 28:02d}", f"{i:02d}-post-{i}")
+        os.makedirs(os.path.join(post_dir, "images"), exist_ok=True)
+        with open(os.path.join(post_dir, f"post-{i}.md"), "w", encoding="utf-8") as f:
+            f.write(f"---\ntitle: Etape {i}\n---\n" + "".join(f"![](images/IMG_{i}_{j}.jpg)\n\n" for j in range(nb_images)))
+        for j in range(nb_images):
+            filename = f"IMG_{i}_{j}.jpg"
+            with open(cache.get_filepath(filename), "wb") as f:
+                f.write((f"image {i + 1} 0" if j == nb_images - 1 else f"image {i} {j}").encode() * 1000)
+            cache.store_blob(filename)
+            cache.cache[f"https://example.com/{filename}"] = filename
+            os.link(cache.get_filepath(filename), os.path.join(post_dir, "images", filename))
+    cache.save_cache()
+    cache.cache.close()
+
+def hash_files(top):
+    hashes = {}
+    for root, dirs, files in os.walk(top):
+        for file in files:
+            file_path = os.path.join(root, file)
+            hashes[os.path.relpath(file_path, top)] = hash_file(file_path)
+    return hashes
+
+def count_unstored(cache):
+    """Images of the cache which are not a link to their blob"""
+    nb_unstored = 0
+    for entry in os.scandir(cache.images_dir):
+        blob_path = cache.get_blob_path(hash_file(entry.path))
+        if not (os.path.exists(blob_path) and os.path.samefile(blob_path, entry.path)):
+            nb_unstored += 1
+    return nb_unstored
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--posts", type=int, default=300, help="number of posts of the synthetic blog")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_dir = os.path.join(tmp_dir, "source")
+        target_dir = os.path.join(tmp_dir, "target")
+        archive_path = os.path.join(tmp_dir, "backup.db")
+        write_blog(source_dir, args.posts)
+
+        start = time.perf_counter()
+        nb_files, nb_blobs = export_backup(archive_path, os.path.join(source_dir, "md"), os.path.join(source_dir, "cache"))
+        print(f"export: {nb_files} files, {nb_blobs} blobs, {os.path.getsize(archive_path) / 1024 / 1024:.1f} MB in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        import_backup(archive_path, target_dir)
+        print(f"import: {time.perf_counter() - start:.2f}s")
+
+        nb_different = 0
+        for name in ("md", os.path.join("cache", "images")):
+            source_hashes = hash_files(os.path.join(source_dir, name))
+            target_hashes = hash_files(os.path.join(target_dir, name))
+            nb_different += len(set(source_hashes.items()) ^ set(target_hashes.items()))
+        print(f"imported files: {nb_different} different")
+
+        cache = Cache(os.path.join(target_dir, "cache"))
+        start = time.perf_counter()
+        nb_linked = cache.store_all_blobs()
+        print(f"blobs: linked {nb_linked} images in {time.perf_counter() - start:.2f}s")
+        nb_unstored = count_unstored(cache)
+        nb_linked_again = cache.store_all_blobs()
+        cache.cache.close()
+        print(f"blobs: {nb_unstored} images not linked to their blob, {nb_linked_again} linked by a second run")
+
+    if nb_different or nb_linked == 0 or nb_unstored or nb_linked_again:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
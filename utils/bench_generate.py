@@ -0,0 +1,137 @@
+# Build a synthetic blog with generate_website.py
+# - a full build, then incremental builds after editing, adding and removing a post
+# - a full build again, with the html rendered by the first one in the render cache
+# - checks that the incremental builds give exactly the same site as a full build
+# - with -j, a full build with JOBS processes, which must give exactly the same site as the serial build
+# - with --rss, the peak memory of a full build of blogs of different sizes, in a new process for each one
+# usage : python -m utils.bench_generate [-n POSTS] [-l LOCALE] [-j JOBS] [--rss POSTS [POSTS ...]]
+import os, sys, time, shutil, argparse, tempfile, hashlib, contextlib, subprocess
+
+import generate_website
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def write_post(md_dir, i, nb_images=3, edited=False):
+    """Post i of the synthetic blog, 3 posts per day, with images and comments"""
+    day = 1 + (i // 3) % 28
+    month = 1 + (i // 84) % 12
+    year = 2007 + i // 1008
+    post_dir = os.path.join(md_dir, f"{year}", f"{month:02d}", f"{day:02d}", f"{i % 3:02d}-post-{i}")
+    os.makedirs(os.path.join(post_dir, "images"), exist_ok=True)
+    parts = [f"---\ntitle: Etape {i}\ndate: {day} {month} {year}\ntags: voyage{i // 50}\n---\n"]
+    for j in range(20):
+        parts.append(f"Paragraphe {j} de l'étape {i} : **gras**, *italique* et [un lien](https://example.com/{i}/{j}).\n\n")
+        if j < nb_images:
+            parts.append(f"[![](images/IMG_{i}_{j}.jpg)](images/IMG_{i}_{j}.jpg)\n\n")
+    if edited:
+        parts.append("Un paragraphe ajouté.\n\n")
+    parts.append("\n\nCommentaires:\n")
+    for j in range(5):
+        parts.append(f"\nAuteur {j} (10 juillet 2023 à 14:{j:02d}):\nBravo pour l'étape {i} !\n\n")
+    with open(os.path.join(post_dir, f"post-{i}.md"), 'w', encoding='utf-8') as f:
+        f.write("".join(parts))
+    for j in range(nb_images):
+        with open(os.path.join(post_dir, "images", f"IMG_{i}_{j}.jpg"), 'wb') as f:
+            f.write(b"\xff\xd8" + f"{i}-{j}".encode() * 100)
+    return post_dir
+
+def make_site(site_dir):
+    os.makedirs(site_dir, exist_ok=True)
+    shutil.copytree(os.path.join(ROOT_DIR, "assets"), os.path.join(site_dir, "assets"))
+
+def build(site_dir, loc, **kwargs):
+    """Run create_website in site_dir, returns the elapsed time"""
+    cwd = os.getcwd()
+    os.chdir(site_dir)
+    try:
+        start = time.perf_counter()
+        # the generator prints one line per page
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            generate_website.create_website(loc=loc, **kwargs)
+        return time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+
+def hash_tree(directory):
+    """sha256 of each file of directory, the build manifest left out"""
+    hashes = {}
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file == ".build_manifest.db":
+                continue
+            file_path = os.path.join(root, file)
+            with open(file_path, 'rb') as f:
+                hashes[os.path.relpath(file_path, directory)] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+def measure_rss(nb_posts, loc, jobs=1):
+    """Elapsed time and peak resident memory in MB of a full build of nb_posts posts, in a new process.
+    The memory of the worker processes of a parallel build is not counted"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        site_dir = os.path.join(tmp_dir, "site")
+        make_site(site_dir)
+        for i in range(nb_posts):
+            write_post(os.path.join(site_dir, "md"), i)
+        code = f"import generate_website; generate_website.create_website(loc={loc!r}, jobs={jobs})"
+        env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-c", code], cwd=site_dir, env=env, stdout=subprocess.DEVNULL)
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            raise RuntimeError(f"build of {nb_posts} posts failed with code {process.returncode}")
+        # ru_maxrss is in kB on linux
+        return elapsed, rusage.ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--posts", type=int, default=3000, help="number of posts of the synthetic blog")
+    parser.add_argument("-l", "--locale", default="C.UTF-8", help="locale of the dates")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="also run a full build with this number of processes")
+    parser.add_argument("--rss", type=int, nargs='+', help="only measure the peak memory of full builds of blogs of these numbers of posts")
+    args = parser.parse_args()
+
+    if args.rss:
+        for nb_posts in args.rss:
+            elapsed, max_rss = measure_rss(nb_posts, args.locale, args.jobs)
+            print(f"{nb_posts} posts: full build {elapsed:.2f}s, peak memory {max_rss:.1f} MB")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        site_dir = os.path.join(tmp_dir, "site")
+        make_site(site_dir)
+        md_dir = os.path.join(site_dir, "md")
+        for i in range(args.posts):
+            write_post(md_dir, i)
+        print(f"{args.posts} posts: full build {build(site_dir, args.locale):.2f}s")
+        print(f"no change: incremental build {build(site_dir, args.locale, incremental=True):.2f}s")
+        print(f"no change: full build with the render cache {build(site_dir, args.locale):.2f}s")
+
+        write_post(md_dir, args.posts // 2, edited=True)
+        print(f"one post edited: incremental build {build(site_dir, args.locale, incremental=True):.2f}s")
+        write_post(md_dir, args.posts)
+        print(f"one post added: incremental build {build(site_dir, args.locale, incremental=True):.2f}s")
+        shutil.rmtree(os.path.join(md_dir, "2007", "01", "01", "01-post-1"))
+        print(f"one post removed: incremental build {build(site_dir, args.locale, incremental=True):.2f}s")
+
+        # a full build of the same posts
+        reference_dir = os.path.join(tmp_dir, "reference")
+        make_site(reference_dir)
+        shutil.copytree(md_dir, os.path.join(reference_dir, "md"))
+        build(reference_dir, args.locale)
+        same = hash_tree(os.path.join(site_dir, "html")) == hash_tree(os.path.join(reference_dir, "html"))
+        print(f"incremental site {'identical' if same else 'DIFFERENT'} to a full build")
+        if args.jobs > 1:
+            parallel_dir = os.path.join(tmp_dir, "parallel")
+            make_site(parallel_dir)
+            shutil.copytree(md_dir, os.path.join(parallel_dir, "md"))
+            print(f"{args.jobs} jobs: full build {build(parallel_dir, args.locale, jobs=args.jobs):.2f}s")
+            same_parallel = hash_tree(os.path.join(parallel_dir, "html")) == hash_tree(os.path.join(reference_dir, "html"))
+            print(f"parallel site {'identical' if same_parallel else 'DIFFERENT'} to a serial build")
+            same = same and same_parallel
+        if not same:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Compare the markdown post-processing of scrapblog with the previous implementation
+# - image urls replaced one after the other with str.replace, comments appended with +=
+# - checks that both produce exactly the same markdown
+# - measures the time per post
+# usage : python -m utils.bench_markdown [-i IMAGES] [-c COMMENTS]
+import sys, time, argparse
+
+from scrapblog import format_comments, get_image_urls, get_image_name, rewrite_image_urls
+
+def legacy_format_comments(comment_elements):
+    START_COMMENT = "\n\nCommentaires:\n"
+    md_text = ""
+    if comment_elements:
+        md_text += START_COMMENT
+        for author, body, timestamp in comment_elements:
+            md_text += f"\n{author} ({timestamp}):\n{body}\n"
+            md_text += "\n"
+    return md_text
+
+def legacy_process(md_text, comment_elements, urls, image_names):
+    md_text += legacy_format_comments(comment_elements)
+    for url in urls:
+        md_text = md_text.replace(url, "images/" + image_names[url])
+    return md_text
+
+def process(md_text, comment_elements, urls, image_names):
+    md_text = "".join([md_text, format_comments(comment_elements)])
+    return rewrite_image_urls(md_text, image_names)
+
+def synthetic_post(nb_images=200, nb_comments=100):
+    """Markdown of a post as written by markdownify: images in links to their full size version,
+    some images used twice, urls which are the prefix of another url, and urls in the text"""
+    parts = ["---\ntitle: Direction equateur\ndate: lundi 10 juillet 2023\n---\n"]
+    for i in range(nb_images):
+        # blogger image ids have different lengths
+        url = f"https://blogger.googleusercontent.com/img/b/R29vZ2xl/AVvXsEi{i:04d}{'k' * (i * 7 % 40)}/s1600/IMG_{i}.jpg"
+        parts.append(f"Paragraphe {i} : l'été à Quito, **gras** et *italique*.\n\n[![]({url.replace('s1600', 's320')})]({url})\n\n")
+        if i % 10 == 0:
+            # the same image again, and an url extending the previous one
+            parts.append(f"[![]({url})]({url}?imgmax=800)\n\n")
+        if i % 50 == 0:
+            # a link showing its url
+            parts.append(f"Voir [{url}]({url}) et https://example.com/page{i}\n\n")
+    comments = [(f"Auteur {i}", f"Bravo pour le voyage {i} ! À bientôt", f"10 juillet 2023 à 14:{i % 60:02d}") for i in range(nb_comments)]
+    return "".join(parts), comments
+
+def measure(function, repeat, *args):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--images", type=int, default=200, help="number of images of the synthetic post")
+    parser.add_argument("-c", "--comments", type=int, default=100, help="number of comments of the synthetic post")
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="number of runs")
+    args = parser.parse_args()
+
+    md_text, comments = synthetic_post(args.images, args.comments)
+    # finding the urls and naming the images is the same for both
+    urls = get_image_urls(md_text)
+    image_names = {url: get_image_name(url) for url in urls}
+    legacy_result, legacy_time = measure(legacy_process, args.repeat, md_text, comments, urls, image_names)
+    result, single_pass_time = measure(process, args.repeat, md_text, comments, urls, image_names)
+    same = result == legacy_result
+    print(f"{args.images} images, {args.comments} comments, {len(md_text) / 1024:.0f} KB: "
+          f"replace per url {1000 * legacy_time:.1f} ms, single pass {1000 * single_pass_time:.1f} ms, "
+          f"speedup x{legacy_time / single_pass_time:.1f}, markdown {'identical' if same else 'DIFFERENT'}")
+    if not same:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
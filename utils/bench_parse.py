@@ -0,0 +1,94 @@
+# Compare the full html.parser parsing of a post page with the targeted lxml parsing of util_parse
+# - checks that both produce exactly the same markdown
+# - measures the parse time per page
+# usage : python -m utils.bench_parse [page.html ...]
+# without argument, a synthetic blogger page is used
+# the synthetic page with an xml declaration, an empty page and a blank page are always checked
+import sys, time, argparse
+from bs4 import BeautifulSoup
+
+from scrapblog import parse_post
+from utils.util_parse import parse_post_page
+
+def synthetic_page(nb_archive_links=600, nb_paragraphs=40, nb_comments=20):
+    """A page shaped like a blogger classic template : scripts, navbar, sidebar with a long archive, one post"""
+    scripts = "".join(f"<script type='text/javascript'>var widget{i} = {{'id': {i}, 'data': '{'x' * 200}'}};</script>" for i in range(30))
+    archive = "".join(f"<li class='archivedate'><a class='post-count-link' href='https://example.blogspot.com/2010/{i % 12 + 1:02d}/'>Archive {i}</a> <span class='post-count'>({i})</span></li>" for i in range(nb_archive_links))
+    paragraphs = "".join(
+        f"<p>Paragraphe {i} : l'été à Quito&nbsp;! <b>gras</b> <i>italique</i><br>"
+        f"<a href='https://blogger.googleusercontent.com/img/b/abc/s1600/IMG_{i}.jpg'><img src='https://blogger.googleusercontent.com/img/b/abc/s320/IMG_{i}.jpg' width='320'></a>"
+        f"<a href='https://example.com/page{i}'>un lien</a></p><ul><li>un</li><li>deux</li></ul>"
+        for i in range(nb_paragraphs))
+    comments = "".join(
+        f"<dt class='comment-author' id='c{i}'><a name='c{i}'></a><a href='https://www.blogger.com/profile/{i}'>Auteur {i}</a> a dit…</dt>"
+        f"<dd class='comment-body'><p>Bravo pour le voyage {i} !<br>À bientôt</p></dd>"
+        f"<dd class='comment-footer'><span class='comment-timestamp'><a href='#c{i}'>10 juillet 2023 à 14:{i % 60:02d}</a></span></dd>"
+        for i in range(nb_comments))
+    return f"""<!DOCTYPE html><html><head><meta charset='UTF-8'><title>Pigeons voyageurs: Direction equateur</title>{scripts}
+<style>body {{ color: black; }}</style></head><body>
+<div class='navbar section' id='navbar'><iframe src='https://www.blogger.com/navbar.g'></iframe></div>
+<div id='outer-wrapper'><div id='main-wrapper'><div class='main section' id='main'><div class='widget Blog' id='Blog1'>
+<div class='blog-posts hfeed'><h2 class='date-header'><span>lundi 10 juillet 2023</span></h2>
+<div class='post-outer'><div class='post hentry'>
+<h3 class='post-title entry-title'><a href='https://example.blogspot.com/2023/07/direction-equateur.html'>Direction equateur - 8 juillet</a></h3>
+<div class='post-header'><div class='post-header-line-1'></div></div>
+<div class='post-body entry-content' id='post-body-1'>{paragraphs}<div style='clear: both;'></div></div>
+<div class='post-footer'><span class='post-author vcard'>Publié par Gabriel</span></div></div>
+<div class='comments' id='comments'><h4>20 commentaires:</h4><div id='Blog1_comments-block-wrapper'>
+<dl class='avatar-comment-indent' id='comments-block'>{comments}</dl></div></div></div></div>
+<div class='blog-pager' id='blog-pager'><span id='blog-pager-newer-link'><a class='blog-pager-newer-link' href='https://example.blogspot.com/2023/07/newer.html'>Article plus récent</a></span>
+<span id='blog-pager-older-link'><a class='blog-pager-older-link' href='https://example.blogspot.com/2023/07/older.html'>Article plus ancien</a></span></div>
+</div></div></div><div id='sidebar-wrapper'><div class='sidebar section'><div class='widget BlogArchive'><ul class='hierarchy'>{archive}</ul></div></div></div></div>
+</body></html>""".encode('utf-8')
+
+def scrap_markdown(url, soup):
+    """Markdown of the post, or the error raised by parse_post, e.g. on an empty page"""
+    try:
+        return parse_post(url, soup)['md_text']
+    except Exception as e:
+        return f"error {type(e).__name__}"
+
+def measure(function, content, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(content)
+    return result, (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages", nargs="*", help="saved blogger post pages")
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="number of parses per page")
+    args = parser.parse_args()
+
+    pages = []
+    for file_path in args.pages:
+        with open(file_path, 'rb') as f:
+            pages.append((file_path, f.read()))
+    if not pages:
+        pages.append(("synthetic page", synthetic_page()))
+    # pages accepted by html.parser which lxml refuses as is
+    pages.append(("xml declaration", b"<?xml version='1.0' encoding='UTF-8'?>\n" + synthetic_page()))
+    pages.append(("empty page", b""))
+    pages.append(("blank page", b" \n\t"))
+
+    nb_different = 0
+    total_full = 0
+    total_targeted = 0
+    for name, content in pages:
+        url = "https://example.blogspot.com/" + name.split('/')[-1]
+        full_soup, full_time = measure(lambda c: BeautifulSoup(c, 'html.parser'), content, args.repeat)
+        targeted_soup, targeted_time = measure(parse_post_page, content, args.repeat)
+        total_full += full_time
+        total_targeted += targeted_time
+        same = scrap_markdown(url, full_soup) == scrap_markdown(url, targeted_soup)
+        if not same:
+            nb_different += 1
+        print(f"{name}: {len(content) / 1024:.0f} KB, html.parser {1000 * full_time:.1f} ms, lxml regions {1000 * targeted_time:.1f} ms, "
+              f"speedup x{full_time / targeted_time:.1f}, markdown {'identical' if same else 'DIFFERENT'}")
+
+    print(f"{len(pages)} pages, speedup x{total_full / total_targeted:.1f}, {nb_different} different markdown")
+    if nb_different:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,31 +2,11 @@ import os, shutil
 import markdown, yaml
 import re
 from bs4 import BeautifulSoup
-from utils.generate_util import parse_markdown_article,get_image_names          
+from utils.generate_util import get_image_names          
+from utils.util_file import link_file
 
-def generate_html_article(article, configuration, prev_link="",next_link=""):
-    """Generate an HTML article file, from an article"""
-    # Convertir le contenu markdown en HTML
-    html_content = article['html_content']
-    articles_dir = configuration['articles_dir']
-    assets_img_dir = configuration['img_dir']
-    css_dir = configuration['css_dir']
-
-    # Extraire les informations importantes des métadonnées
-    title = article.get('title', 'Titre de l\'article')
-    collection = article.get('tags', 'Autre')
-    date = article.get('date', 'Date inconnue')
-
-    nav_links = ""
-    if prev_link or next_link:
-        nav_links = f"""
-        <nav>
-            {f'<a href="../../../../../{prev_link}">Article précédent</a>' if prev_link else ''}
-            {f'<a href="../../../../../{next_link}">Article suivant</a>' if next_link else ''}
-        </nav>
-        """
-
-    # Générer le chemin de sortie pour le fichier HTML
+def get_article_paths(article, configuration):
+    """Directory and file of the html page of an article, and the name of its source directory"""
     md_file_path = article['file_path']
     # articles are located in /path/to/YYYY/MM/DD/subdir/article.md
     # get articles subpath /YYYY/MM/DD/subdir/
@@ -38,22 +18,29 @@ def generate_html_article(article, configuration, prev_link="",next_link=""):
     subpath = '/'.join(path_elems)
 
     # directory where the article will be saved
-    article_dir = os.path.join(articles_dir, subpath)
+    article_dir = os.path.join(configuration['articles_dir'], subpath)
     article_file_path = os.path.join(article_dir, html_name)
+    return article_dir, article_file_path, article_subdir
 
-    if not os.path.exists(article_dir):
-        os.makedirs(article_dir)
-
+def get_article_images(article, configuration):
+    """Images of the article: (path of the source image, path in the assets directory)"""
+    archive = configuration.get('archive')
+    article_subdir = get_article_paths(article, configuration)[2]
     # source directory for the images
-    src_images_dir = os.path.join(os.path.dirname(md_file_path), 'images')
-    # copy the images directory that contains the article images to the output directory
-    for root, dirs, files in os.walk(src_images_dir):
+    src_images_dir = os.path.join(os.path.dirname(article['file_path']), 'images')
+    images = []
+    for root, dirs, files in (archive.walk(src_images_dir) if archive else os.walk(src_images_dir)):
         for file in files:
-            original_img_path = os.path.join(root, file)
             # create a unique name for the images
-            new_img_path = os.path.join(assets_img_dir, f"{article_subdir}_{file}")
-            shutil.copy2(original_img_path, new_img_path)
-    
+            images.append((os.path.join(root, file), os.path.join(configuration['img_dir'], f"{article_subdir}_{file}")))
+    return images
+
+def rewrite_html_content(article, configuration):
+    """Content of the article with its image links pointing to the assets directory, and its comments styled"""
+    html_content = article['html_content']
+    article_dir, _, article_subdir = get_article_paths(article, configuration)
+    assets_img_dir = configuration['img_dir']
+
     # modify the html content to point to the images in the assets directory
     image_names = get_image_names(html_content)
     for img_name in image_names:
@@ -67,6 +54,96 @@ def generate_html_article(article, configuration, prev_link="",next_link=""):
     if len(comments) > 1:
         html_content = comments[0] + "<div class='comments'>\n" + "<h3>Commentaires:</h3>\n"+ comments[1] + "\n</div>"
         #print(html_content)
+    return html_content
+
+# the index pages show the beginning of the articles: their first paragraphs, up to this number of characters of text
+# and of paragraphs with images
+EXCERPT_LENGTH = 500
+EXCERPT_IMAGE_BLOCKS = 1
+# tags and comments of html, the void elements have no closing tag
+TAG_PATTERN = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)\b[^>]*>|<!--.*?-->', re.DOTALL)
+IMG_PATTERN = re.compile(r'<img\b', re.IGNORECASE)
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+def split_blocks(html_content):
+    """Top level elements of html_content, each one with the text before it. The html is only read up to the last block used"""
+    depth = 0
+    start = 0
+    for match in TAG_PATTERN.finditer(html_content):
+        closing, name = match.groups()
+        if name is None:
+            continue
+        if name.lower() in VOID_ELEMENTS or match.group(0).endswith('/>'):
+            closed = depth == 0
+        elif closing:
+            depth = max(depth - 1, 0)
+            closed = depth == 0
+        else:
+            depth += 1
+            closed = False
+        if closed:
+            yield html_content[start:match.end()]
+            start = match.end()
+    if html_content[start:].strip():
+        yield html_content[start:]
+
+def get_excerpt(html_content, link):
+    """Beginning of the content of an article, without its comments, for the index pages.
+    Ends with a link to the article page (link is relative to the index pages) when the article is longer"""
+    content, comments_div, _ = html_content.partition("<div class='comments'>")
+    blocks = []
+    text_length = 0
+    nb_image_blocks = 0
+    truncated = bool(comments_div)
+    for block in split_blocks(content):
+        block = block.strip()
+        if not block:
+            continue
+        has_images = IMG_PATTERN.search(block) is not None
+        if blocks and (text_length >= EXCERPT_LENGTH or (has_images and nb_image_blocks >= EXCERPT_IMAGE_BLOCKS)):
+            truncated = True
+            break
+        blocks.append(block)
+        text_length += len(TAG_PATTERN.sub('', block).strip())
+        nb_image_blocks += has_images
+    if truncated:
+        blocks.append(f'<p class="read-more"><a href="{link}">Lire la suite</a></p>')
+    return "\n".join(blocks)
+
+def generate_html_article(article, configuration, prev_link="",next_link=""):
+    """Generate an HTML article file, from an article"""
+    # Convertir le contenu markdown en HTML
+    html_content = rewrite_html_content(article, configuration)
+    css_dir = configuration['css_dir']
+    archive = configuration.get('archive')
+
+    # Extraire les informations importantes des métadonnées
+    title = article.get('title', 'Titre de l\'article')
+    collection = article.get('tags', 'Autre')
+    date = article.get('date', 'Date inconnue')
+
+    nav_links = ""
+    if prev_link or next_link:
+        nav_links = f"""
+        <nav>
+            {f'<a href="../../../../../{prev_link}">Article précédent</a>' if prev_link else ''}
+            {f'<a href="../../../../../{next_link}">Article suivant</a>' if next_link else ''}
+        </nav>
+        """
+
+    # Générer le chemin de sortie pour le fichier HTML
+    md_file_path = article['file_path']
+    article_dir, article_file_path, article_subdir = get_article_paths(article, configuration)
+
+    if not os.path.exists(article_dir):
+        os.makedirs(article_dir)
+
+    # copy the images directory that contains the article images to the output directory
+    for original_img_path, new_img_path in get_article_images(article, configuration):
+        if archive:
+            archive.extract_file(original_img_path, new_img_path)
+        else:
+            link_file(original_img_path, new_img_path)
 
     article['html_content'] = html_content
 
@@ -0,0 +1,187 @@
+import os, json, hashlib, sqlite3
+import markdown
+
+from utils.util_file import hash_file
+from utils.generate_util import article_from_entry, get_collection
+
+# code of the generator, a change of a template rebuilds the whole site
+GENERATOR_FILES = ['generate_website.py', 'utils/generate_articles.py', 'utils/generate_collections.py',
+                   'utils/generate_index.py', 'utils/generate_util.py', 'utils/generate_build.py', 'utils/generate_jobs.py']
+
+def hash_inputs(inputs):
+    """Hash of the inputs of a page, a json serializable value"""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def get_generator_version(assets_dir="assets"):
+    """Hash of the code of the generator, of the markdown version and of the assets copied in the site"""
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    hashes = [markdown.__version__]
+    for file in GENERATOR_FILES:
+        hashes.append(hash_file(os.path.join(root_dir, file)))
+    for file in sorted(os.listdir(assets_dir)):
+        hashes.append(file + hash_file(os.path.join(assets_dir, file)))
+    return hash_inputs(hashes)
+
+def get_files_inputs(images, archive=None):
+    """Version of the images of an article: inode, size and modification time, or their hash in an archive"""
+    inputs = []
+    for file_path, new_file_path in images:
+        if archive:
+            inputs.append([new_file_path, archive.get_sha(file_path)])
+        else:
+            stat = os.stat(file_path)
+            inputs.append([new_file_path, stat.st_ino, stat.st_size, stat.st_mtime_ns])
+    return inputs
+
+class BuildManifest:
+    """Inputs of each page generated by the last build, kept in the sqlite file html/.build_manifest.db.
+    A page is generated again only when the hash of its inputs changed or when one of its files is missing.
+    The pages and files of the last build which are not generated by the current one are removed.
+    The entries are read and written one page at a time, the manifest is never loaded in memory"""
+    def __init__(self, html_dir, manifest_file=".build_manifest.db"):
+        self.html_dir = html_dir
+        self.manifest_path = os.path.join(html_dir, manifest_file)
+        # files of the pages generated again which are no longer generated with them, e.g. a removed image
+        self.dropped_files = set()
+        self.open()
+
+    def open(self):
+        os.makedirs(self.html_dir, exist_ok=True)
+        self.conn = sqlite3.connect(self.manifest_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # seen: the page is generated by the current build
+        self.conn.execute("CREATE TABLE IF NOT EXISTS pages (page_file TEXT PRIMARY KEY, inputs TEXT NOT NULL, excerpt TEXT, seen INTEGER NOT NULL)")
+        # other files generated with a page, e.g. the images of an article
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (file TEXT NOT NULL, page_file TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_page ON files (page_file)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_file ON files (file)")
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        self.version = row[0] if row else None
+        # the changes of the build are committed by save
+        self.conn.execute("UPDATE pages SET seen = 0")
+
+    def reset(self, version):
+        """Forget the last build, every page is generated again"""
+        self.conn.close()
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        self.dropped_files = set()
+        self.open()
+        self.version = version
+
+    def get_files(self, page_file):
+        return [row[0] for row in self.conn.execute("SELECT file FROM files WHERE page_file = ?", (page_file,))]
+
+    def is_up_to_date(self, page_file, inputs):
+        """True if page_file was generated from the same inputs, and its files still exist"""
+        row = self.conn.execute("SELECT inputs FROM pages WHERE page_file = ?", (page_file,)).fetchone()
+        if not row or row[0] != inputs:
+            return False
+        return os.path.isfile(page_file) and all(os.path.isfile(file) for file in self.get_files(page_file))
+
+    def add(self, page_file, inputs, files=(), excerpt=None):
+        """excerpt: of the article of an article page, shown on the index pages"""
+        files = list(files)
+        self.dropped_files.update(set(self.get_files(page_file)) - set(files))
+        self.conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, 1)", (page_file, inputs, excerpt))
+        self.conn.execute("DELETE FROM files WHERE page_file = ?", (page_file,))
+        self.conn.executemany("INSERT INTO files VALUES (?, ?)", [(file, page_file) for file in files])
+
+    def get_excerpt(self, page_file):
+        """Excerpt of the article of page_file"""
+        row = self.conn.execute("SELECT excerpt FROM pages WHERE page_file = ?", (page_file,)).fetchone()
+        return row[0] if row else None
+
+    def is_generated(self, file):
+        """True if file is a page of the current build or one of its files"""
+        if self.conn.execute("SELECT 1 FROM pages WHERE page_file = ? AND seen = 1", (file,)).fetchone():
+            return True
+        return self.conn.execute("SELECT 1 FROM files JOIN pages ON pages.page_file = files.page_file "
+                                 "WHERE files.file = ? AND pages.seen = 1", (file,)).fetchone() is not None
+
+    def remove_stale(self):
+        """Remove the files of the last build which are no longer generated, returns the number of removed files"""
+        stale_pages = [row[0] for row in self.conn.execute("SELECT page_file FROM pages WHERE seen = 0")]
+        stale_files = sorted(self.dropped_files)
+        for page_file in stale_pages:
+            stale_files += [page_file] + self.get_files(page_file)
+        nb_removed = 0
+        for file in stale_files:
+            if not self.is_generated(file) and os.path.isfile(file):
+                os.remove(file)
+                nb_removed += 1
+                print(f"Removed {file}")
+                # remove the directories of a removed article
+                directory = os.path.dirname(file)
+                while directory.startswith(self.html_dir + os.sep) and not os.listdir(directory):
+                    os.rmdir(directory)
+                    directory = os.path.dirname(directory)
+        self.conn.execute("DELETE FROM files WHERE page_file IN (SELECT page_file FROM pages WHERE seen = 0)")
+        self.conn.execute("DELETE FROM pages WHERE seen = 0")
+        self.dropped_files = set()
+        return nb_removed
+
+    def save(self):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class ArticleIndex:
+    """Metadata of the articles, by file path, kept between builds in a sqlite file: title, date, tags, link, collection,
+    hash of the content, and modification time and size of the file.
+    The articles whose file did not change are not read. The articles are listed in order, and grouped in collections,
+    from the index: they are never all in memory"""
+    def __init__(self, index_path):
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(index_path)
+        # seen: the file of the article was found by the current build
+        self.conn.execute("CREATE TABLE IF NOT EXISTS articles (file_path TEXT PRIMARY KEY, stat TEXT NOT NULL, hash TEXT NOT NULL, "
+                          "title TEXT, tags TEXT, link TEXT NOT NULL, date TEXT NOT NULL, collection TEXT NOT NULL, seen INTEGER NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS articles_date ON articles (date, file_path)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS articles_collection ON articles (collection, date, file_path)")
+        self.conn.execute("UPDATE articles SET seen = 0")
+
+    def get(self, file_path):
+        """Metadata of the article of file_path in the last build, None if it is not in the index"""
+        row = self.conn.execute("SELECT stat, hash, title, tags, link, date FROM articles WHERE file_path = ?", (file_path,)).fetchone()
+        if row is None:
+            return None
+        return {'stat': json.loads(row[0]), 'hash': row[1], 'title': json.loads(row[2]), 'tags': json.loads(row[3]),
+                'link': row[4], 'date': row[5]}
+
+    def add(self, article):
+        self.conn.execute("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)",
+                          (article['file_path'], json.dumps(article['stat']), article['hash'],
+                           json.dumps(article['title'], ensure_ascii=False, default=str), json.dumps(article['tags'], ensure_ascii=False, default=str),
+                           article['link'], article['date'].isoformat(), get_collection(article)))
+
+    def remove_unseen(self):
+        """Forget the articles whose file was not found by the current build"""
+        self.conn.execute("DELETE FROM articles WHERE seen = 0")
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+    def get_collections(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT collection FROM articles ORDER BY collection")]
+
+    def iter_articles(self, collection=None):
+        """Articles most recent first, of a collection or of the whole blog, read from the index one at a time"""
+        query = "SELECT file_path, stat, hash, title, tags, link, date FROM articles"
+        params = ()
+        if collection is not None:
+            query += " WHERE collection = ?"
+            params = (collection,)
+        # the articles of the same date are in the order of their files
+        cursor = self.conn.execute(query + " ORDER BY date DESC, file_path", params)
+        for file_path, stat, content_hash, title, tags, link, date in cursor:
+            yield article_from_entry(file_path, {'stat': json.loads(stat), 'hash': content_hash, 'title': json.loads(title),
+                                                 'tags': json.loads(tags), 'link': link, 'date': date})
+
+    def save(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
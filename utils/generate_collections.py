@@ -8,8 +8,11 @@ def generate_collection_index(configuration, collections):
     theme = configuration['theme']
     collections_dir = configuration['collections_dir']
 
-    # Générer le contenu HTML pour l'index des collections
-    html_content = f"""
+    index_file_path = os.path.join(collections_dir, 'index.html')
+    # the page is written part by part
+    with open(index_file_path, 'w', encoding='utf-8') as f:
+        # Générer le contenu HTML pour l'index des collections
+        f.write(f"""
     <!DOCTYPE html>
     <html lang="fr">
     <head>
@@ -25,13 +28,13 @@ def generate_collection_index(configuration, collections):
         <main>
             <div class="article article-list">
             <ul>
-    """
+    """)
 
-    # Ajouter la liste des collections
-    for collection in collections:
-        html_content += f"<li><a href=\"{collection}.html\">{collection}</a></li>"
+        # Ajouter la liste des collections
+        for collection in collections:
+            f.write(f"<li><a href=\"{collection}.html\">{collection}</a></li>")
 
-    html_content += """
+        f.write("""
             </ul>
             </div>
         </main>
@@ -40,26 +43,19 @@ def generate_collection_index(configuration, collections):
         </footer>
     </body>
     </html>
-    """
-
-    # Écrire le fichier HTML de l'index des collections
-    index_file_path = os.path.join(collections_dir, 'index.html')
-    with open(index_file_path, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    """)
 
     print(f"Page HTML générée pour l'index des collections : {index_file_path}")
 
-def generate_collection_pages(articles, configuration, collections):
-    """Generate HTML collection pages"""
-   
-    # Generate HTML page for each collection
-    for collection in collections:
-
-        collection_file_path = os.path.join(configuration['collections_dir'], f"{collection}.html")
-        theme = configuration['theme']
+def generate_collection_page(collection, articles, configuration):
+    """Generate the HTML page of a collection, from the articles of the collection"""
+    collection_file_path = os.path.join(configuration['collections_dir'], f"{collection}.html")
+    theme = configuration['theme']
 
+    # the page is written part by part, the list of the articles is not concatenated in memory
+    with open(collection_file_path, 'w', encoding='utf-8') as f:
         # Générer le contenu HTML pour la collection
-        html_content = f"""
+        f.write(f"""
         <!DOCTYPE html>
         <html lang="fr">
         <head>
@@ -75,15 +71,12 @@ def generate_collection_pages(articles, configuration, collections):
             </header>
             <main>
                 <ul>
-        """
+        """)
         # Ajouter la liste des articles dans cette collection
         for article in articles:
-            art_col = f"{article['date'].year}-{article['tags']}"
-            if art_col == collection:
-                html_content += f"<li><a href=\"../{article['link']}\">{article['title']}</a></li>"
-            
+            f.write(f"<li><a href=\"../{article['link']}\">{article['title']}</a></li>")
 
-        html_content += """
+        f.write("""
                 </ul>
             </main>
             <footer>
@@ -91,20 +84,6 @@ def generate_collection_pages(articles, configuration, collections):
             </footer>
         </body>
         </html>
-        """
-
-        # Écrire le fichier HTML de la collection
-        with open(collection_file_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-
-        print(f"Page HTML générée pour la collection : {collection_file_path}")
-
-        generate_collection_index(configuration, collections)
-
-if __name__ == "__main__":
-    # Exemple d'utilisation
-    content_dir = './md'
-    html_articles_dir = './blog/html/articles'
-    html_collections_dir = './blog/html/collections'
+        """)
 
-    generate_collection_pages(content_dir, html_articles_dir, html_collections_dir)
+    print(f"Page HTML générée pour la collection : {collection_file_path}")
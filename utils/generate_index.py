@@ -1,20 +1,18 @@
 import os
-import math
 import yaml
 from datetime import datetime
 
-def generate_index_pages(articles, configuration, collections, articles_per_page=5):
-    """Generate index page for the blog"""
-    # Pagination
-    total_pages = math.ceil(len(articles) / articles_per_page)
-    html_dir = configuration['html_dir']
+def get_index_page_file(configuration, page_num):
+    return os.path.join(configuration['html_dir'], f'index{"" if page_num == 1 else f"_{page_num}"}.html')
+
+def generate_index_page(page_articles, configuration, collections, page_num, total_pages):
+    """Generate the index page page_num, listing page_articles"""
+    page_file = get_index_page_file(configuration, page_num)
     theme = configuration['theme']
-    
-    for page_num in range(1, total_pages + 1):
-        page_file = os.path.join(html_dir, f'index{"" if page_num == 1 else f"_{page_num}"}.html')
-        
+    # the page is written part by part, the articles are not concatenated in memory
+    with open(page_file, 'w', encoding='utf-8') as f:
         # Generate page content
-        html_content = f"""
+        f.write(f"""
         <!DOCTYPE html>
         <html lang="fr">
         <head>
@@ -35,15 +33,12 @@ def generate_index_pages(articles, configuration, collections, articles_per_page
             </header>
             <main>
                 <section class="article-list">
-        """
+        """)
 
-        # Ajouter les articles de cette page
-        start_idx = (page_num - 1) * articles_per_page
-        end_idx = start_idx + articles_per_page
-        for article in articles[start_idx:end_idx]:
+        for article in page_articles:
             # articles are 5 levels of directory below
-            content = article['html_content'].replace('../../../../../assets','assets')
-            html_content += f"""
+            content = article['excerpt'].replace('../../../../../assets','assets')
+            f.write(f"""
             <article class="article">
                 <h2><a href="{article["link"]}">{article['title']}</a></h2>
                 <p class="date">{article['date'].strftime('%d %B %Y').capitalize()}</p>
@@ -56,30 +51,30 @@ def generate_index_pages(articles, configuration, collections, articles_per_page
                 </div>
                 
             </article>
-            """
+            """)
 
-        html_content += """
+        f.write("""
                 </section>
-        """
+        """)
 
         # Ajouter les liens de pagination
-        html_content += '<nav aria-label="Pagination"><ul class="pagination">\n'
+        f.write('<nav aria-label="Pagination"><ul class="pagination">\n')
         if page_num > 1:
-            html_content += f'<li><a href="index_{page_num - 1}.html">Précédent</a></li>\n'
+            f.write(f'<li><a href="index_{page_num - 1}.html">Précédent</a></li>\n')
         if page_num < total_pages:
-            html_content += f'<li><a href="index_{page_num + 1}.html">Suivant</a></li>\n'
-        html_content += '</ul></nav>\n'
+            f.write(f'<li><a href="index_{page_num + 1}.html">Suivant</a></li>\n')
+        f.write('</ul></nav>\n')
 
         # Ajouter la section des collections
-        html_content += """
+        f.write("""
             <footer id="collections">
                 <h2>Collections</h2>
                 <p>
-        """
+        """)
         for collection in collections:
-            html_content += f'<a href="collections/{collection}.html">{collection}</a> '
+            f.write(f'<a href="collections/{collection}.html">{collection}</a> ')
 
-        html_content += """
+        f.write("""
                 </p>
             </footer>
             </main>
@@ -88,10 +83,6 @@ def generate_index_pages(articles, configuration, collections, articles_per_page
             </footer>
         </body>
         </html>
-        """
-
-        # Écrire la page HTML
-        with open(page_file, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        """)
 
-        print(f"Page d'index {page_num} générée : {page_file}")
+    print(f"Page d'index {page_num} générée : {page_file}")
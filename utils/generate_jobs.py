@@ -0,0 +1,80 @@
+# parallel build of generate_website.py --jobs : the articles are read, rendered and written in worker processes
+import locale
+import itertools
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.generate_articles import generate_html_article, get_excerpt
+from utils.generate_util import load_article, Article, RenderCache
+from utils.util_archive import Archive
+
+# configuration of the build in the current process, set by init_worker or start_jobs
+_configuration = None
+
+def init_worker(configuration, archive_path, loc, render_cache_dir=None):
+    """Runs in each worker process. A sqlite connection can not be shared with the workers, each one opens the archive"""
+    global _configuration
+    locale.setlocale(locale.LC_TIME, loc)
+    _configuration = dict(configuration, archive=Archive(archive_path) if archive_path else None)
+    Article.archive = _configuration['archive']
+    Article.render_cache = RenderCache(render_cache_dir) if render_cache_dir else None
+
+def start_jobs(configuration, archive_path, loc, jobs=1, render_cache_dir=None):
+    """Process pool of the build, None for a serial build: the jobs then run in this process"""
+    global _configuration
+    if jobs <= 1:
+        _configuration = configuration
+        Article.archive = configuration['archive']
+        Article.render_cache = RenderCache(render_cache_dir) if render_cache_dir else None
+        return None
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                               initargs=(dict(configuration, archive=None), archive_path, loc, render_cache_dir))
+
+# chunks of jobs submitted to the pool ahead of the results, the arguments of all the jobs are never in memory
+MAX_PENDING_CHUNKS = 64
+
+def run_chunk(function, chunk):
+    return [function(*args) for args in chunk]
+
+def map_jobs(executor, function, args, chunksize=8):
+    """Results of function(*arguments) for each tuple of arguments of the iterable args, in order.
+    args is consumed as the results are used"""
+    if executor is None:
+        yield from itertools.starmap(function, args)
+        return
+    pending = collections.deque()
+    args = iter(args)
+    while True:
+        while len(pending) < MAX_PENDING_CHUNKS:
+            chunk = list(itertools.islice(args, chunksize))
+            if not chunk:
+                break
+            pending.append(executor.submit(run_chunk, function, chunk))
+        if not pending:
+            return
+        yield from pending.popleft().result()
+
+def load_article_job(root, file, known_entry):
+    return load_article(root, file, known_entry, _configuration['archive'])
+
+def with_render_stats(function, *args):
+    """Result of function, with the hits and misses of the render cache of this process while it ran"""
+    render_cache = Article.render_cache
+    if render_cache is None:
+        return function(*args), 0, 0
+    hits, misses = render_cache.hits, render_cache.misses
+    result = function(*args)
+    return result, render_cache.hits - hits, render_cache.misses - misses
+
+def generate_article(article, prev_link, next_link):
+    generate_html_article(article, _configuration, prev_link, next_link)
+    excerpt = get_excerpt(article['html_content'], article['link'])
+    # the index pages only need the excerpt, the content of the article is not kept
+    article.pop('md_content', None)
+    article.pop('html_content', None)
+    return excerpt
+
+def generate_article_job(article, prev_link, next_link):
+    """Render and write the page of an article, copy its images.
+    Returns the excerpt of the article shown on the index pages, and the hits and misses of the render cache"""
+    return with_render_stats(generate_article, article, prev_link, next_link)
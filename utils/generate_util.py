@@ -2,39 +2,43 @@ import markdown,yaml
 import datetime
 import os,shutil
 import re
+import hashlib
+import json
 
 
-def parse_markdown_article(md_file_path):
-    """Parse markdown file, extract meta data and content"""
-    with open(md_file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+# YAML front matter at the start of a markdown file
+YAML_PATTERN = re.compile(r'^---\s*\n(.*?)\n---\s*\n', re.DOTALL)
 
-        # Use regex to extract the YAML front matter
-        yaml_pattern = re.compile(r'^---\s*\n(.*?)\n---\s*\n', re.DOTALL)
-        match = yaml_pattern.match(content)
-
-        if match:
-            yaml_content = match.group(1)
-            md_content = content[match.end():]
-
-            # Parse YAML content
-            try:
-                meta_data = yaml.safe_load(yaml_content)
-            except yaml.YAMLError as e:
-                # If YAML parsing fails, try a custom approach
-                # some data contains ':' so we split on the first ':' encountered
-                print(f"Error parsing YAML in {md_file_path}: {e}")
-                meta_data = {}
-                for line in yaml_content.split('\n'):
-                    if ':' in line:
-                        key, value = line.split(':', 1)
-                        meta_data[key.strip()] = value.strip()
+def split_front_matter(content):
+    """Returns the YAML front matter of a markdown text, None if there is none, and the markdown content"""
+    match = YAML_PATTERN.match(content)
+    if match:
+        return match.group(1), content[match.end():]
+    return None, content
 
-        else:
+def parse_markdown_content(content, md_file_path):
+    """Extract meta data and content of a markdown text, md_file_path is only used in error messages"""
+    # Use regex to extract the YAML front matter
+    yaml_content, md_content = split_front_matter(content)
+
+    if yaml_content is not None:
+        # Parse YAML content
+        try:
+            meta_data = yaml.safe_load(yaml_content)
+        except yaml.YAMLError as e:
+            # If YAML parsing fails, try a custom approach
+            # some data contains ':' so we split on the first ':' encountered
+            print(f"Error parsing YAML in {md_file_path}: {e}")
             meta_data = {}
-            md_content = content
+            for line in yaml_content.split('\n'):
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    meta_data[key.strip()] = value.strip()
+
+    else:
+        meta_data = {}
 
-        return meta_data, md_content
+    return meta_data, md_content
 
 
 def parse_markdown_metadata(md_file_path):
@@ -47,45 +51,180 @@ def parse_markdown_metadata(md_file_path):
             return meta_data
     return {}
 
-def get_sorted_articles(content_dir):
-    articles = []
+# extensions of the markdown renderer, part of the key of the render cache
+MARKDOWN_EXTENSIONS = []
+
+class RenderCache:
+    """html rendered from markdown, kept between builds in cache_dir/<2 first chars of the key>/<key>.html.
+    The key is the sha256 of the markdown, of the markdown version and of the extensions, so an unchanged post is not rendered again.
+    Each file is written then renamed, the processes of a parallel build can share the cache"""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, md_content):
+        settings = json.dumps([markdown.__version__, MARKDOWN_EXTENSIONS])
+        return hashlib.sha256((settings + md_content).encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.html')
+
+    def render(self, md_content):
+        cache_path = self.get_path(self.get_key(md_content))
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                html_content = f.read()
+            self.hits += 1
+            return html_content
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        html_content = render_markdown(md_content)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        os.replace(tmp_path, cache_path)
+        return html_content
+
+def render_markdown(md_content):
+    return markdown.markdown(md_content, extensions=MARKDOWN_EXTENSIONS)
+
+class Article(dict):
+    """An article of the blog. Its md_content is read from its file, and its html_content is rendered from md_content,
+    the first time they are used"""
+    # RenderCache of this process, None to always render the markdown
+    render_cache = None
+    # utils.util_archive.Archive the articles are read from in this process, None to read them from the disk
+    archive = None
+
+    def __missing__(self, key):
+        if key == 'md_content':
+            md_content = split_front_matter(read_article_file(self['file_path'], self.archive))[1]
+            self['md_content'] = md_content
+            return md_content
+        if key != 'html_content':
+            raise KeyError(key)
+        md_content = self['md_content']
+        if self['is_html']:
+            html_content = md_content
+        elif self.render_cache:
+            html_content = self.render_cache.render(md_content)
+        else:
+            html_content = render_markdown(md_content)
+        self['html_content'] = html_content
+        return html_content
+
+def find_article_files(content_dir, archive=None):
+    """(directory, file name) of the articles of content_dir, yielded while walking the directories"""
+    walk = archive.walk(content_dir) if archive else os.walk(content_dir)
     # Parcourir les articles et extraire les métadonnées
-    for root, dirs, files in os.walk(content_dir):
+    for root, dirs, files in walk:
+        # the images directory of a post also holds the html pages it links to
+        if 'images' in dirs:
+            dirs.remove('images')
         for file in files:
+            # html saved by scrapblog.py --format html is used as is, without rendering the markdown
+            if file.endswith('.md') and file.replace('.md', '.html') in files:
+                continue
             if file.endswith('.md'):
-                md_file_path = os.path.join(root, file)
-                #meta_data = parse_markdown_metadata(md_file_path)
-                meta_data, md_content = parse_markdown_article(md_file_path)
-                title = meta_data.get('title', 'Sans titre')
-                tags = meta_data.get('tags', [])
-                #article_relative_path = os.path.relpath(os.path.join(html_dir, root, file.replace('.md', '.html')), html_dir + '/articles')
-                article_relative_path = root.split('/')
-                article_relative_path = os.path.join('articles','/'.join(article_relative_path[-4:]),file.replace('.md','.html'))
-                # date can be extract from current directory
-                current_path = article_relative_path.split('/')
-
-                # remove the last element (the file name)
-                current_path.pop()
-                # remove article folder
-                folder = current_path.pop()
-                # folder starts with two digits, use them as the hour
-                hour = 23 - int(folder[:2])
-                # last 3 elements are the date
-                date = datetime.datetime.strptime('/'.join(current_path[-3:]) + f":{hour}", '%Y/%m/%d:%H')
-                img_prefix= os.path.basename(file).replace('.html', '') + '_'
-                articles.append({
-                    'title': title,
-                    'date': date,
-                    'tags': tags,
-                    'link': article_relative_path,
-                    'file_path' : os.path.join(root, file),
-                    'img_prefix' : img_prefix,
-                    'html_content' : markdown.markdown(md_content)
-                })
-
-    
-    articles = sorted(articles, key=lambda x: x['date'], reverse=True)
-    return articles
+                yield root, file
+            elif file.endswith('.html') and is_post_html(content_dir, root, file, archive):
+                yield root, file
+
+def is_post_html(content_dir, root, file, archive=None):
+    """True if file is a post saved in html: in a post directory (YYYY/MM/DD/NN-post) and starting with front matter"""
+    if len(os.path.relpath(root, content_dir).split(os.sep)) != 4:
+        return False
+    file_path = os.path.join(root, file)
+    if archive:
+        start = archive.read_bytes(file_path)[:3]
+    else:
+        with open(file_path, 'rb') as f:
+            start = f.read(3)
+    return start == b'---'
+
+def read_article_file(file_path, archive=None):
+    if archive:
+        return archive.read_text(file_path)
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def get_file_stat(file_path, archive=None):
+    """Version of a file, without reading it: its modification time and size, or its hash in an archive"""
+    if archive:
+        return {'sha': archive.get_sha(file_path)}
+    stat = os.stat(file_path)
+    return {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+def get_article_location(root, file):
+    """Link and date of an article, from the path of its file"""
+    #article_relative_path = os.path.relpath(os.path.join(html_dir, root, file.replace('.md', '.html')), html_dir + '/articles')
+    article_relative_path = root.split('/')
+    article_relative_path = os.path.join('articles','/'.join(article_relative_path[-4:]),file.replace('.md','.html'))
+    # date can be extract from current directory
+    current_path = article_relative_path.split('/')
+
+    # remove the last element (the file name)
+    current_path.pop()
+    # remove article folder
+    folder = current_path.pop()
+    # folder starts with two digits, use them as the hour
+    hour = 23 - int(folder[:2])
+    # last 3 elements are the date
+    year, month, day = current_path[-3:]
+    date = datetime.datetime(int(year), int(month), int(day), hour)
+    return article_relative_path, date
+
+def get_collection(article):
+    """A collection is the year of the article and its tags"""
+    return f"{article['date'].year}-{article['tags']}"
+
+def article_from_entry(file_path, entry):
+    """Article of file_path from its metadata in the index of the articles, see utils.generate_build.ArticleIndex"""
+    file = os.path.basename(file_path)
+    return Article({
+        'title': entry['title'],
+        'date': datetime.datetime.fromisoformat(entry['date']),
+        'tags': entry['tags'],
+        'link': entry['link'],
+        'file_path': file_path,
+        'img_prefix': file.replace('.html', '') + '_',
+        'hash': entry['hash'],
+        'is_html': file.endswith('.html'),
+        'stat': entry['stat']
+    })
+
+def load_article(root, file, known_entry=None, archive=None):
+    """Metadata of an article, its md_content is read and its html_content rendered when its page is generated.
+    known_entry: metadata of the article in the last build. If the file did not change, it is not read"""
+    md_file_path = os.path.join(root, file)
+    stat = get_file_stat(md_file_path, archive)
+    if known_entry and known_entry['stat'] == stat:
+        return article_from_entry(md_file_path, known_entry)
+    article = Article({
+        'file_path' : md_file_path,
+        'img_prefix' : os.path.basename(file).replace('.html', '') + '_',
+        'is_html': file.endswith('.html'),
+        'stat': stat
+    })
+
+    content = read_article_file(md_file_path, archive)
+    content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    if known_entry and known_entry['hash'] == content_hash:
+        # touched but unchanged
+        title = known_entry['title']
+        tags = known_entry['tags']
+    else:
+        #meta_data = parse_markdown_metadata(md_file_path)
+        meta_data, _ = parse_markdown_content(content, md_file_path)
+        title = meta_data.get('title', 'Sans titre')
+        tags = meta_data.get('tags', [])
+    link, date = get_article_location(root, file)
+    # md_content is not kept, it is read again when the article is generated: the memory used does not grow with the number of articles
+    article.update(title=title, tags=tags, hash=content_hash, link=link, date=date)
+    return article
 
 def clean_output_directory(output_dir):
     """Clean up the output directory before generating new content."""
@@ -0,0 +1,228 @@
+import requests
+from requests.adapters import HTTPAdapter
+import email.utils
+import threading
+import time
+import urllib.parse
+
+# responses worth retrying: rate limiting and transient server errors
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# responses meaning the host wants us to slow down
+THROTTLE_STATUS = {429, 503}
+
+class HostLimiter:
+    """Adaptive number of concurrent requests to one host (additive increase, multiplicative decrease).
+    The limit doubles every round of successful requests until the first slow down, then grows by one per round.
+    It is halved on 429/503, on errors, or when the latency rises well above the fastest response seen.
+    The throttled request waits for its Retry-After delay, once the limit is down to one request, all the requests to the host wait"""
+    # latencies below this margin are noise, even if they are several times the fastest response
+    LATENCY_MARGIN = 0.05
+
+    def __init__(self, max_limit=8, initial_limit=2, latency_factor=3.0):
+        self.condition = threading.Condition()
+        self.max_limit = max_limit
+        self.limit = float(min(initial_limit, max_limit))
+        self.latency_factor = latency_factor
+        self.slow_start = True
+        self.active = 0
+        self.min_latency = None
+        self.resume_at = 0
+        self.last_decrease = 0
+        self.requests = 0
+        self.throttled = 0
+        self.peak_limit = self.limit
+        self.first_request = None
+        self.last_response = None
+
+    def acquire(self):
+        """Wait for a free slot, and for the end of a Retry-After pause"""
+        with self.condition:
+            while True:
+                delay = self.resume_at - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                elif self.active >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    break
+            self.active += 1
+            if self.first_request is None:
+                self.first_request = time.monotonic()
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def record(self, start, latency, status=None, retry_after=None):
+        """Adapt the limit to the response of a request sent at start (time.monotonic()),
+        latency is None for connection errors and timeouts"""
+        now = time.monotonic()
+        with self.condition:
+            self.requests += 1
+            self.last_response = now
+            if status in THROTTLE_STATUS:
+                self.throttled += 1
+                if retry_after and self.limit <= 1:
+                    # already down to one request at a time, pause the host as asked
+                    self.resume_at = max(self.resume_at, now + retry_after)
+                self.decrease(start, now)
+            elif latency is None:
+                self.decrease(start, now)
+            else:
+                if self.min_latency is None or latency < self.min_latency:
+                    self.min_latency = latency
+                if latency > self.latency_factor * self.min_latency + self.LATENCY_MARGIN:
+                    self.decrease(start, now)
+                else:
+                    # one more slot per round of limit requests, or one per request during the slow start
+                    self.limit = min(self.max_limit, self.limit + (1 if self.slow_start else 1 / self.limit))
+                    self.peak_limit = max(self.peak_limit, self.limit)
+            self.condition.notify_all()
+
+    def decrease(self, start, now):
+        self.slow_start = False
+        # requests sent before the last decrease see the same congestion, the limit is decreased once per round
+        if start >= self.last_decrease:
+            self.limit = max(1.0, self.limit / 2)
+            self.last_decrease = now
+
+    def get_stats(self):
+        with self.condition:
+            duration = (self.last_response or 0) - (self.first_request or 0)
+            return {
+                'requests': self.requests,
+                'requests_per_second': self.requests / duration if duration > 0 else 0.0,
+                'throttled': self.throttled,
+                'limit': int(self.limit),
+                'peak_limit': int(self.peak_limit),
+            }
+
+class HttpClient:
+    """HTTP client shared by the crawler, the scraper and the image cache.
+    Connections are kept alive in one pool per host, requests are retried with an exponential backoff.
+    The number of concurrent requests to each host is adapted to its responses, up to max_per_host"""
+    def __init__(self, timeout=(10, 60), retries=4, backoff=0.5, max_per_host=8):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_per_host = max_per_host
+        self.session = requests.Session()
+        # pool_block : never open more than max_per_host connections to the same host, wait for a free one instead
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_per_host, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.limiters = {}
+
+    def get_limiter(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            if host not in self.limiters:
+                self.limiters[host] = HostLimiter(self.max_per_host)
+            return self.limiters[host]
+
+    def get_retry_after(self, response):
+        """Seconds asked by the Retry-After header of response, None if there is none"""
+        retry_after = response.headers.get("Retry-After")
+        if not retry_after:
+            return None
+        if retry_after.isdigit():
+            return int(retry_after)
+        try:
+            date = email.utils.parsedate_to_datetime(retry_after)
+            return max(0, date.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def get_delay(self, attempt, response=None):
+        """Seconds to wait before the next attempt, honors the Retry-After header"""
+        if response is not None:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None:
+                return retry_after
+        return self.backoff * (2 ** attempt)
+
+    def get(self, url, hold=False, **kwargs):
+        """GET url, retrying on connection errors, timeouts, 429 and 5xx.
+        Once retries are exhausted, the last response is returned or the last error is raised.
+        With hold=True, the concurrency slot of the host is kept until release(url) is called, for streamed downloads"""
+        kwargs.setdefault("timeout", self.timeout)
+        limiter = self.get_limiter(url)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                limiter.record(start, None)
+                limiter.release()
+                if attempt >= self.retries:
+                    raise
+                delay = self.get_delay(attempt)
+                print(f"Error fetching {url}: {e}, retrying in {delay:.1f}s")
+            except BaseException:
+                limiter.release()
+                raise
+            else:
+                # with stream=True, the latency is the time to the response headers
+                limiter.record(start, time.monotonic() - start, response.status_code, self.get_retry_after(response))
+                if response.status_code not in RETRY_STATUS or attempt >= self.retries:
+                    if not hold:
+                        limiter.release()
+                    return response
+                limiter.release()
+                delay = self.get_delay(attempt, response)
+                print(f"Got {response.status_code} for {url}, retrying in {delay:.1f}s")
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def release(self, url):
+        """Release the slot kept by get(url, hold=True)"""
+        self.get_limiter(url).release()
+
+    def download(self, url, file_path):
+        """Download url into file_path, returns the number of bytes written.
+        The body is read while holding the concurrency slot of the host"""
+        response = self.get(url, hold=True, stream=True)
+        try:
+            with response:
+                response.raise_for_status()
+                size = 0
+                with open(file_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                        size += len(chunk)
+        finally:
+            self.release(url)
+        return size
+
+    def get_stats(self):
+        """Requests, requests per second and concurrency limit reached for each host"""
+        with self.lock:
+            limiters = dict(self.limiters)
+        return {host: limiter.get_stats() for host, limiter in sorted(limiters.items())}
+
+    def report(self):
+        for host, stats in self.get_stats().items():
+            print(f"{host}: {stats['requests']} requests, {stats['requests_per_second']:.1f} req/s, "
+                  f"concurrency {stats['limit']} (peak {stats['peak_limit']}), {stats['throttled']} throttled")
+
+_client = None
+_client_lock = threading.Lock()
+
+def configure(**kwargs):
+    """Replace the shared client, e.g. configure(timeout=30, retries=2)"""
+    global _client
+    with _client_lock:
+        _client = HttpClient(**kwargs)
+    return _client
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+class Metrics:
+    """Wall and CPU time per stage, and counters, collected from every thread of a run"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.sections = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time the block: wall time, and CPU time of the current thread"""
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+    def add_stage(self, name, wall, cpu):
+        with self.lock:
+            stage = self.stages.setdefault(name, {'count': 0, 'wall': 0.0, 'cpu': 0.0})
+            stage['count'] += 1
+            stage['wall'] += wall
+            stage['cpu'] += cpu
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_section(self, name, data):
+        """Extra data of the run saved in the json report, e.g. the http statistics per host"""
+        with self.lock:
+            self.sections[name] = data
+
+    def to_dict(self):
+        elapsed = time.perf_counter() - self.start_time
+        with self.lock:
+            rates = {}
+            for name in ('posts', 'images'):
+                if name in self.counters and elapsed > 0:
+                    rates[f"{name}_per_second"] = self.counters[name] / elapsed
+            data = {
+                'elapsed': elapsed,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters),
+                'rates': rates,
+            }
+            data.update(self.sections)
+            return data
+
+    def report(self):
+        data = self.to_dict()
+        print(f"Elapsed: {data['elapsed']:.2f}s")
+        if data['stages']:
+            # stages run in several threads, their wall times can add up to more than the elapsed time
+            width = max(len(name) for name in data['stages'])
+            print(f"{'stage':{width}s} {'count':>8s} {'wall (s)':>10s} {'cpu (s)':>10s} {'avg (ms)':>10s}")
+            for name, stage in sorted(data['stages'].items(), key=lambda item: -item[1]['wall']):
+                average = 1000 * stage['wall'] / stage['count']
+                print(f"{name:{width}s} {stage['count']:8d} {stage['wall']:10.2f} {stage['cpu']:10.2f} {average:10.1f}")
+        for name, value in sorted(data['counters'].items()):
+            if name.startswith('bytes'):
+                print(f"{name}: {value / 1024 / 1024:.2f} MB")
+            else:
+                print(f"{name}: {value}")
+        for name, value in sorted(data['rates'].items()):
+            print(f"{name}: {value:.2f}")
+
+    def save(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+# metrics of the current run, shared by all modules
+metrics = Metrics()
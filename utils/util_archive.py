@@ -0,0 +1,186 @@
+import os, sqlite3, hashlib, threading, tempfile
+
+from utils.util_file import link_file
+
+class Archive:
+    """A backup packed in a single sqlite file: the md directory and the image cache.
+    Each file is stored under its path (e.g. md/2023/07/10/00-post/post.md, cache/images/IMG_1.jpg),
+    its content is stored once per sha256 in the blobs table, so hardlinked images take no extra space.
+    Files are read directly from the archive, without extracting it"""
+    def __init__(self, archive_path, create=False):
+        if not create and not os.path.isfile(archive_path):
+            raise FileNotFoundError(archive_path)
+        self.archive_path = archive_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(archive_path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS blobs (sha TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, sha TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL)")
+        # copy of the index of the image cache, so images can be found by url
+        self.conn.execute("CREATE TABLE IF NOT EXISTS images (url TEXT PRIMARY KEY, filename TEXT NOT NULL)")
+        self.conn.commit()
+
+    def add_file(self, file_path, path):
+        """Store the content of file_path under path, returns True if the content was not already in the archive"""
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        sha = hashlib.sha256(data).hexdigest()
+        stat = os.stat(file_path)
+        with self.lock:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO blobs (sha, data) VALUES (?, ?)", (sha, data))
+            self.conn.execute("INSERT OR REPLACE INTO files (path, sha, size, mtime) VALUES (?, ?, ?, ?)",
+                              (path, sha, stat.st_size, stat.st_mtime))
+        return cursor.rowcount == 1
+
+    def add_images_index(self, entries):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO images (url, filename) VALUES (?, ?)", entries)
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def list_files(self, prefix=""):
+        """Paths of the files under prefix, in sorted order"""
+        with self.lock:
+            rows = self.conn.execute("SELECT path FROM files WHERE substr(path, 1, ?) = ? ORDER BY path",
+                                     (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def walk(self, top):
+        """Same as os.walk(top) over the files of the archive : yields (root, dirs, files) for each directory.
+        As with os.walk, the directories removed from dirs are not walked"""
+        prefix = top.rstrip('/') + '/'
+        tree = {}
+        for path in self.list_files(prefix):
+            parts = path[len(prefix):].split('/')
+            node = tree
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node.setdefault(None, []).append(parts[-1])
+
+        def walk_node(root, node):
+            dirs = sorted(name for name in node if name is not None)
+            yield root, dirs, node.get(None, [])
+            for name in dirs:
+                yield from walk_node(os.path.join(root, name), node[name])
+
+        if tree:
+            yield from walk_node(top.rstrip('/'), tree)
+
+    def exists(self, path):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM files WHERE path = ?", (path,)).fetchone() is not None
+
+    def get_sha(self, path):
+        with self.lock:
+            row = self.conn.execute("SELECT sha FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(path)
+        return row[0]
+
+    def read_bytes(self, path):
+        with self.lock:
+            row = self.conn.execute("SELECT blobs.data FROM files JOIN blobs ON blobs.sha = files.sha WHERE files.path = ?",
+                                    (path,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(path)
+        return row[0]
+
+    def read_text(self, path, encoding='utf-8'):
+        return self.read_bytes(path).decode(encoding)
+
+    def extract_file(self, path, file_path):
+        """Write the file stored under path to file_path, with its modification time"""
+        data = self.read_bytes(path)
+        with self.lock:
+            mtime = self.conn.execute("SELECT mtime FROM files WHERE path = ?", (path,)).fetchone()[0]
+        if os.path.lexists(file_path):
+            os.remove(file_path)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        os.utime(file_path, (mtime, mtime))
+
+    def get_image_path(self, url):
+        """Path in the archive of the cached image of url, None if the url is not in the archive"""
+        with self.lock:
+            row = self.conn.execute("SELECT filename FROM images WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        path = "cache/images/" + row[0]
+        return path if self.exists(path) else None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def export_backup(archive_path, md_dir="md", cache_dir="cache", progress_every=1000):
+    """Pack the md directory and the image cache in archive_path.
+    The archive is written to a temporary file, and replaces archive_path once complete.
+    Derived files are not packed: the blob store (rebuilt from the images by cache.py blobs after an import) and unfinished downloads"""
+    archive_dir = os.path.dirname(os.path.abspath(archive_path))
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=archive_dir)
+    os.close(fd)
+    archive = Archive(tmp_path, create=True)
+    nb_files = 0
+    nb_blobs = 0
+    try:
+        sources = [(md_dir, "md")]
+        for name in ("images", "pages"):
+            sources.append((os.path.join(cache_dir, name), "cache/" + name))
+        for source_dir, prefix in sources:
+            for root, dirs, files in os.walk(source_dir):
+                dirs.sort()
+                for file in sorted(files):
+                    file_path = os.path.join(root, file)
+                    path = prefix + "/" + os.path.relpath(file_path, source_dir).replace(os.sep, "/")
+                    if archive.add_file(file_path, path):
+                        nb_blobs += 1
+                    nb_files += 1
+                    if nb_files % progress_every == 0:
+                        archive.commit()
+                        print(f"Packed {nb_files} files")
+
+        # consistent copy of the cache index, even while a scrap is running
+        index_path = os.path.join(cache_dir, "cache.db")
+        if os.path.isfile(index_path):
+            source = sqlite3.connect(index_path)
+            try:
+                archive.add_images_index(source.execute("SELECT url, filename FROM images").fetchall())
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    copy_path = os.path.join(tmp_dir, "cache.db")
+                    copy = sqlite3.connect(copy_path)
+                    source.backup(copy)
+                    copy.close()
+                    archive.add_file(copy_path, "cache/cache.db")
+            finally:
+                source.close()
+        archive.commit()
+    except BaseException:
+        archive.close()
+        os.remove(tmp_path)
+        raise
+    archive.close()
+    os.replace(tmp_path, archive_path)
+    return nb_files, nb_blobs
+
+def import_backup(archive_path, target_dir=".", progress_every=1000):
+    """Extract an archive in target_dir. Files with the same content are hardlinked, as in the backup"""
+    archive = Archive(archive_path)
+    extracted = {}
+    nb_files = 0
+    try:
+        for path in archive.list_files():
+            file_path = os.path.join(target_dir, *path.split("/"))
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            sha = archive.get_sha(path)
+            if sha in extracted and path != "cache/cache.db":
+                link_file(extracted[sha], file_path)
+            else:
+                archive.extract_file(path, file_path)
+                extracted[sha] = file_path
+            nb_files += 1
+            if nb_files % progress_every == 0:
+                print(f"Extracted {nb_files} files")
+    finally:
+        archive.close()
+    return nb_files
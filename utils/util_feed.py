@@ -0,0 +1,123 @@
+import urllib.parse, datetime
+from concurrent.futures import ThreadPoolExecutor
+from utils.http_client import get_client
+
+# Blogger serves at most 150 entries per feed page
+FEED_PAGE_SIZE = 150
+
+def get_feed_url(blog_url, start_index=1, max_results=FEED_PAGE_SIZE, orderby="published"):
+    """Build the url of a page of the blogger json feed"""
+    params = urllib.parse.urlencode({
+        "alt": "json",
+        "orderby": orderby,
+        "start-index": start_index,
+        "max-results": max_results,
+    })
+    return urllib.parse.urljoin(blog_url.rstrip('/') + '/', "feeds/posts/default") + "?" + params
+
+def get_feed_page(blog_url, start_index=1, max_results=FEED_PAGE_SIZE, orderby="published"):
+    """Fetch one page of the feed, returns the decoded 'feed' object"""
+    page = get_client().get(get_feed_url(blog_url, start_index, max_results, orderby))
+    page.raise_for_status()
+    return page.json()["feed"]
+
+def get_total_results(feed):
+    return int(feed.get("openSearch$totalResults", {}).get("$t", 0))
+
+def get_feed_entries(feed):
+    """Returns the entries of a feed page as a list of dict(url, published, updated)"""
+    entries = []
+    for entry in feed.get("entry", []):
+        url = None
+        for link in entry.get("link", []):
+            if link.get("rel") == "alternate":
+                url = link.get("href")
+                break
+        # drafts have no public url
+        if not url:
+            continue
+        entries.append({
+            "url": url,
+            "published": entry.get("published", {}).get("$t", ""),
+            "updated": entry.get("updated", {}).get("$t", ""),
+        })
+    return entries
+
+def get_feed_posts(blog_url, max=None, page_size=FEED_PAGE_SIZE, workers=8):
+    """Returns all posts urls from the feed, newest first.
+    The first page gives the total number of posts, remaining pages are fetched concurrently"""
+    if max is not None:
+        page_size = min(page_size, max)
+    first_page = get_feed_page(blog_url, 1, page_size)
+    total = get_total_results(first_page)
+    if max is not None:
+        total = min(total, max)
+    print(f"Feed reports {total} posts")
+
+    pages = [get_feed_entries(first_page)]
+    start_indexes = list(range(1 + page_size, total + 1, page_size))
+    if start_indexes:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map() keeps the pages in the order of their start index
+            feeds = executor.map(lambda start: get_feed_page(blog_url, start, page_size), start_indexes)
+            for feed in feeds:
+                pages.append(get_feed_entries(feed))
+
+    # a post published while crawling shifts the pages by one, skip duplicates
+    posts = []
+    seen = set()
+    for entries in pages:
+        for entry in entries:
+            if entry["url"] not in seen:
+                seen.add(entry["url"])
+                posts.append(entry["url"])
+    if max is not None:
+        posts = posts[:max]
+    return posts
+
+def get_new_feed_posts(blog_url, known, max=None, start_index=1, posts=None, page_size=25, checkpoint=None):
+    """Returns the posts urls newer than the first url found in known, newest first.
+    Pages are read one after the other, checkpoint(posts, next_start_index) is called after each page,
+    and when max new posts were added to posts: the crawl then resumes from the page being read"""
+    if posts is None:
+        posts = []
+    nb_added = 0
+    while True:
+        feed = get_feed_page(blog_url, start_index, page_size)
+        nb_entries = len(feed.get("entry", []))
+        if nb_entries == 0:
+            return posts
+        for entry in get_feed_entries(feed):
+            if entry["url"] in known:
+                print(f"Reached known post {entry['url']}")
+                return posts
+            if entry["url"] not in posts:
+                posts.append(entry["url"])
+                nb_added += 1
+            if max is not None and nb_added >= max:
+                if checkpoint:
+                    checkpoint(posts, start_index)
+                return posts
+        start_index += nb_entries
+        if checkpoint:
+            checkpoint(posts, start_index)
+
+def parse_feed_date(text):
+    """Date of a feed entry, e.g. 2023-07-10T14:52:00.000+02:00"""
+    return datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+
+def get_updated_feed_posts(blog_url, since=None, page_size=25):
+    """Returns {url: updated} for the posts updated after since, most recently updated first.
+    The feed is read ordered by update date, so reading stops at the first post not updated since"""
+    posts = {}
+    start_index = 1
+    while True:
+        feed = get_feed_page(blog_url, start_index, page_size, orderby="updated")
+        nb_entries = len(feed.get("entry", []))
+        if nb_entries == 0:
+            return posts
+        for entry in get_feed_entries(feed):
+            if since is not None and entry["updated"] and parse_feed_date(entry["updated"]) <= since:
+                return posts
+            posts.setdefault(entry["url"], entry["updated"])
+        start_index += nb_entries
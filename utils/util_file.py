@@ -0,0 +1,22 @@
+import os, shutil
+import hashlib
+
+def link_file(src, dst):
+    """Make dst a hardlink to src. Falls back to a copy when the link is not possible,
+    e.g. when src and dst are on different filesystems"""
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """sha256 of the content of file_path"""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
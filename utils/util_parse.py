@@ -0,0 +1,71 @@
+import re
+import lxml.html
+import lxml.etree
+import bleach
+from bs4 import BeautifulSoup, UnicodeDammit
+
+# classes of the elements read by the crawler and the scraper
+POST_CLASSES = ['post-title', 'date-header', 'entry-content', 'blog-pager-older-link', 'blog-pager-newer-link']
+
+# contains() is only a cheap pre-filter, classes are then checked exactly in is_region
+# a single union keeps the regions in document order
+REGIONS_XPATH = "//*[" + " or ".join(f"contains(@class, '{c}')" for c in POST_CLASSES) + "] | //dl[@id='comments-block']"
+
+# lxml refuses a decoded string starting with an xml declaration which names an encoding
+XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+# html kept by the html storage mode: text formatting, links, images, lists and tables
+ALLOWED_TAGS = ['a', 'abbr', 'b', 'blockquote', 'br', 'code', 'div', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr',
+                'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'small', 'span', 'strike', 'strong', 'sub', 'sup',
+                'table', 'tbody', 'td', 'th', 'thead', 'tr', 'u', 'ul']
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title'],
+    'img': ['src', 'alt', 'title', 'width', 'height'],
+    'td': ['colspan', 'rowspan'],
+    'th': ['colspan', 'rowspan'],
+}
+# elements removed with their content, bleach would keep their text
+REMOVED_TAGS = ['script', 'style', 'noscript', 'iframe']
+
+def is_region(element):
+    if element.tag == 'dl' and element.get('id') == 'comments-block':
+        return True
+    classes = (element.get('class') or '').split()
+    return any(c in classes for c in POST_CLASSES)
+
+def parse_post_page(content):
+    """Parse a blogger page with lxml, and returns a BeautifulSoup document containing only
+    the title and the regions used by the scraper : post title, date header, entry content, comments and pager links.
+    Building the BeautifulSoup tree for these few regions is much faster than for the whole page"""
+    if isinstance(content, bytes):
+        # same encoding detection as BeautifulSoup
+        content = UnicodeDammit(content, is_html=True).unicode_markup
+    content = XML_DECLARATION.sub("", content, count=1)
+    try:
+        root = lxml.html.document_fromstring(content)
+    except lxml.etree.ParserError:
+        # an empty page is an empty document, as with html.parser
+        return BeautifulSoup("<html><head></head><body></body></html>", 'lxml')
+
+    regions = []
+    selected = set()
+    for element in root.xpath(REGIONS_XPATH):
+        if not is_region(element):
+            continue
+        # an element inside an already selected region is part of that region
+        if any(ancestor in selected for ancestor in element.iterancestors()):
+            continue
+        selected.add(element)
+        regions.append(lxml.html.tostring(element, encoding='unicode', with_tail=False))
+
+    title = root.find('.//title')
+    head = lxml.html.tostring(title, encoding='unicode', with_tail=False) if title is not None else ""
+    return BeautifulSoup(f"<html><head>{head}</head><body>{''.join(regions)}</body></html>", 'lxml')
+
+def clean_post_html(html):
+    """Sanitized html of a post body: scripts and styles are removed, only ALLOWED_TAGS and ALLOWED_ATTRIBUTES are kept"""
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(REMOVED_TAGS):
+        element.decompose()
+    return bleach.clean(str(soup), tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES,
+                        protocols=['http', 'https', 'mailto'], strip=True, strip_comments=True)
@@ -1,35 +1,145 @@
 import urllib.request, urllib.parse, urllib.error
 import re, os, sys,argparse,json
+import sqlite3, threading, hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from PIL import Image
 import pyheif
+from utils.http_client import get_client
+from utils.util_file import link_file, hash_file
+from utils.metrics import metrics
+import time
+
+class CacheIndex:
+    """Association between an image url and its filename in the cache, stored in sqlite.
+    Lookups by url and by filename are indexed, each change is a small transaction appended to the journal"""
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS images (url TEXT PRIMARY KEY, filename TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS images_filename ON images (filename)")
+        # HEIC files already converted : sha256 of the HEIC content -> sha256 of the JPEG blob
+        self.conn.execute("CREATE TABLE IF NOT EXISTS conversions (heic_sha TEXT PRIMARY KEY, jpg_sha TEXT NOT NULL)")
+        self.conn.commit()
+
+    def get(self, url, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT filename FROM images WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else default
+
+    def has_filename(self, filename):
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM images WHERE filename = ? LIMIT 1", (filename,)).fetchone()
+        return row is not None
+
+    def update(self, entries):
+        """Add several url -> filename entries in a single transaction"""
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO images (url, filename) VALUES (?, ?)", entries)
+
+    def get_conversion(self, heic_sha):
+        with self.lock:
+            row = self.conn.execute("SELECT jpg_sha FROM conversions WHERE heic_sha = ?", (heic_sha,)).fetchone()
+        return row[0] if row else None
+
+    def add_conversion(self, heic_sha, jpg_sha):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO conversions (heic_sha, jpg_sha) VALUES (?, ?)", (heic_sha, jpg_sha))
+
+    def iter_items(self, batch_size=1000):
+        """Yields the (url, filename) entries, reading the index batch_size rows at a time.
+        Entries can be deleted while iterating"""
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute("SELECT rowid, url, filename FROM images WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                         (last_rowid, batch_size)).fetchall()
+            if not rows:
+                return
+            for rowid, url, filename in rows:
+                yield url, filename
+            last_rowid = rows[-1][0]
+
+    def delete_filename(self, filename):
+        """Remove all the urls pointing to filename"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM images WHERE filename = ?", (filename,))
+
+    def items(self):
+        with self.lock:
+            return self.conn.execute("SELECT url, filename FROM images ORDER BY rowid").fetchall()
+
+    def values(self):
+        return [filename for _, filename in self.items()]
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def __getitem__(self, url):
+        filename = self.get(url)
+        if filename is None:
+            raise KeyError(url)
+        return filename
+
+    def __setitem__(self, url, filename):
+        self.update([(url, filename)])
+
+    def __delitem__(self, url):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM images WHERE url = ?", (url,))
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
 
 class Cache:
-    def __init__(self, cache_dir="cache",cache_file="cache.json"):
+    def __init__(self, cache_dir="cache",cache_file="cache.json",index_file="cache.db"):
         self.cache_dir = cache_dir
         self.cache_file = cache_file
+        self.index_file = index_file
         self.images_dir = cache_dir + "/images/"
+        self.blobs_dir = cache_dir + "/blobs/"
+        self.tmp_dir = cache_dir + "/tmp/"
         os.makedirs(cache_dir, exist_ok=True)
         os.makedirs(self.images_dir, exist_ok=True)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
         self.cache = self.load_cache()
 
     # the cache dir stores
-    # - cache.json file : association between a url and an unique image file
+    # - cache.db file : sqlite index, association between a url and an unique image file
     # - an images/ dir containing all previously downloaded images. Image filename is unique 
+    # - a blobs/ dir : content addressed store, blobs/ab/abcd... is named after the sha256 of its content.
+    #   Each file of images/ is a hardlink to its blob, so images with the same content are stored once
+    # - a tmp/ dir where images are downloaded, they are moved to images/ once complete
+    # older versions stored the association in cache.json, it is imported in cache.db the first time the cache is opened
     def load_cache(self):
-        try:
-            with open(os.path.join(self.cache_dir, self.cache_file), 'r') as f:
-                cache = json.load(f)
-                return cache
-            # return json.load(f)
-        except FileNotFoundError:
-            return {}
+        index = CacheIndex(os.path.join(self.cache_dir, self.index_file))
+        json_path = os.path.join(self.cache_dir, self.cache_file)
+        if os.path.isfile(json_path):
+            with open(json_path, 'r') as f:
+                entries = json.load(f)
+            index.update(list(entries.items()))
+            os.replace(json_path, json_path + ".migrated")
+            print(f"Migrated {len(entries)} entries from {json_path} to {index.db_path}")
+        return index
 
     def save_cache(self):
-        with open(os.path.join(self.cache_dir,self.cache_file), 'w') as f:
-            json.dump(self.cache, f)
+        # every change is already committed by the index
+        self.cache.commit()
 
     def is_file_in_cache(self,filename):
-        return filename in self.cache.values()
+        return self.cache.has_filename(filename)
     
     def is_url_in_cache(self, url):
         filename = self.cache.get(url,None)
@@ -42,50 +152,151 @@ class Cache:
                 self.save_cache()
         return False
     
-    def convert_heic_to_jpg(self,heic_file_path, jpg_file_path):
-        print(f"Converting {heic_file_path} to {jpg_file_path}")
-        # Open the HEIC file using pyheif
-        heif_file = pyheif.read(heic_file_path)
-
-        # Convert the HEIC data to a Pillow image
-        image = Image.frombytes(
-            heif_file.mode, 
-            heif_file.size, 
-            heif_file.data,
-            "raw",
-            heif_file.mode,
-            heif_file.stride,
-        )
-
-        # Save the image as a JPG
-        image.save(jpg_file_path, "JPEG")
+    def convert_heic(self, heic_file_path, jpg_file_path, converter=None):
+        """Convert a HEIC file to JPEG, a HEIC content is decoded only once : the result is recorded in the index
+        and the JPEG blob is reused for the next files with the same content.
+        The decoding runs in the process pool of converter if given"""
+        heic_sha = hash_file(heic_file_path)
+        jpg_sha = self.cache.get_conversion(heic_sha)
+        if jpg_sha and os.path.isfile(self.get_blob_path(jpg_sha)):
+            link_file(self.get_blob_path(jpg_sha), jpg_file_path)
+            return
+        if converter:
+            converter.convert(heic_file_path, jpg_file_path)
+        else:
+            with metrics.stage("heic_conversion"):
+                convert_heic_to_jpg(heic_file_path, jpg_file_path)
+        jpg_sha = self.store_blob_file(jpg_file_path)
+        self.cache.add_conversion(heic_sha, jpg_sha)
+
+    def try_convert_heic(self, heic_file_path, converter=None):
+        """Convert a downloaded HEIC file, returns the path of the JPEG file, None if it is not a real HEIC file"""
+        jpg_file_path = heic_file_path.replace(".part", ".jpg.part")
+        try:
+            self.convert_heic(heic_file_path, jpg_file_path, converter)
+            return jpg_file_path
+        except Exception as e:
+            print(f"Could not convert {heic_file_path}: {e}")
+            if os.path.exists(jpg_file_path):
+                os.remove(jpg_file_path)
+            return None
+
+    def get_tmp_path(self, url):
+        """Temporary file where url is downloaded, before being moved to images/"""
+        return os.path.join(self.tmp_dir, hashlib.sha1(url.encode()).hexdigest() + ".part")
 
     def add_file(self, url, filename):
-        heic_filename = None
         # check if url is already in cache
         if not self.is_url_in_cache(url):
-            # check if file is in HEIC format
-            if UrlChecker(url).has_extension() and url.split('.')[-1].lower() == "heic":
-                heic_filename = filename
-                filename = filename.split('.')[0] + ".jpg"
+            tmp_path = self.get_tmp_path(url)
+            with metrics.stage("image_download"):
+                metrics.add("bytes_images", get_client().download(url, tmp_path))
+            jpg_path = None
+            if UrlChecker(url).is_heic():
+                jpg_path = self.try_convert_heic(tmp_path)
+            self.add_downloaded_file(url, filename, tmp_path, jpg_path)
+
+    def add_downloaded_file(self, url, filename, tmp_path, jpg_path=None):
+        """Move a file downloaded in tmp_path to images/ with a unique name, then add it to the index.
+        For a HEIC url, jpg_path is the converted file, None if the download was not a real HEIC file"""
+        heic_filename = None
+        # check if file is in HEIC format
+        if UrlChecker(url).is_heic():
+            heic_filename = filename
+            filename = filename.split('.')[0] + ".jpg"
+
+        # filename contains a jpg extension, add a "_" prefix to the filename until it's unique
+        while self.is_file_in_cache(filename):
+            filename = "_" + filename
 
-            # filename contains a jpg extension, add a "_" prefix to the filename until it's unique
-            while self.is_file_in_cache(filename):
+        if heic_filename and jpg_path:
+            # keep the original HEIC file next to the converted one
+            os.replace(tmp_path, os.path.join(self.cache_dir, "images", heic_filename))
+            os.replace(jpg_path, os.path.join(self.cache_dir, "images", filename))
+        else:
+            # not a real heic file, just rename the file assuming it is a jpeg
+            os.replace(tmp_path, os.path.join(self.cache_dir, "images", filename))
+        self.store_blob(filename)
+        self.cache[url] = filename
+        self.save_cache()
+        metrics.add("images")
+
+    def get_blob_path(self, sha):
+        return os.path.join(self.blobs_dir, sha[:2], sha)
+
+    def store_blob(self, filename):
+        """Move the content of images/filename to the blob store, images/filename becomes a hardlink to the blob.
+        If the same content is already stored, the new file is replaced by a link to the existing blob.
+        Returns the sha256 of the content"""
+        return self.store_blob_file(self.get_filepath(filename))
+
+    def store_blob_file(self, file_path, sha=None):
+        sha = sha or hash_file(file_path)
+        blob_path = self.get_blob_path(sha)
+        if os.path.exists(blob_path):
+            link_file(blob_path, file_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            link_file(file_path, blob_path)
+        return sha
+
+    def store_all_blobs(self):
+        """Add the images which are not linked to their blob, e.g. downloaded before the blob store existed
+        or extracted by archive.py import. Returns the number of files linked to a blob"""
+        nb_files = 0
+        for entry in os.scandir(self.images_dir):
+            if not entry.is_file():
+                continue
+            # the number of links of a file does not tell if it is stored: an imported image is linked to the post images
+            sha = hash_file(entry.path)
+            blob_path = self.get_blob_path(sha)
+            if os.path.exists(blob_path) and os.path.samefile(blob_path, entry.path):
+                continue
+            self.store_blob_file(entry.path, sha)
+            nb_files += 1
+        return nb_files
+
+    def convert_all_heic(self, converter):
+        """Convert the HEIC images of the index to JPEG, the index then points to the JPEG file.
+        Returns the number of converted images"""
+        heic_entries = [(url, filename) for url, filename in self.cache.items() if filename.lower().endswith(".heic")]
+        print(f"Found {len(heic_entries)} HEIC images in the index")
+        jobs = []
+        reserved = set()
+        for url, heic_filename in heic_entries:
+            heic_path = self.get_filepath(heic_filename)
+            if not os.path.isfile(heic_path):
+                print(f"File {heic_filename} not found in cache")
+                continue
+            filename = heic_filename.rsplit('.', 1)[0] + ".jpg"
+            while filename in reserved or self.is_file_in_cache(filename) or os.path.exists(self.get_filepath(filename)):
                 filename = "_" + filename
+            reserved.add(filename)
+            jpg_path = self.get_tmp_path(url)
+            # convert_heic blocks until its conversion is done, submit them from threads to use every process
+            jobs.append((url, filename, jpg_path, converter.thread_pool.submit(self.convert_heic, heic_path, jpg_path, converter)))
 
-            if heic_filename:
-                # download heic file
-                urllib.request.urlretrieve(url, os.path.join(self.cache_dir, "images", heic_filename))
-                try:
-                    # convert heic to jpg
-                    self.convert_heic_to_jpg(os.path.join(self.cache_dir, "images", heic_filename), os.path.join(self.cache_dir, "images", filename))
-                except:
-                    # not a real heic file, just rename the file assuming it is a jpeg
-                    os.rename(os.path.join(self.cache_dir, "images", heic_filename), os.path.join(self.cache_dir, "images", filename))
-            else:
-                urllib.request.urlretrieve(url, os.path.join(self.cache_dir, "images", filename))
+        nb_converted = 0
+        for url, filename, jpg_path, job in jobs:
+            try:
+                job.result()
+            except Exception as e:
+                print(f"Could not convert {url}: {e}")
+                continue
+            os.replace(jpg_path, self.get_filepath(filename))
+            self.store_blob(filename)
             self.cache[url] = filename
-            self.save_cache()
+            nb_converted += 1
+            if nb_converted % 10 == 0:
+                print(f"Converted {nb_converted}/{len(jobs)} images")
+        return nb_converted
+
+    def get_image_key(self, url):
+        """Url under which the image of url is cached: the url itself when it was downloaded by an older version,
+        else its normalized url, shared by all the sizes of a blogger image"""
+        if self.cache.get(url):
+            return url
+        return normalize_image_url(url)
 
     def get_filepath(self, filename):
         return os.path.join(self.images_dir, filename)
@@ -93,6 +304,339 @@ class Cache:
     def get_filename(self, url):
         return self.cache.get(url, None)
 
+def convert_heic_to_jpg(heic_file_path, jpg_file_path):
+    print(f"Converting {heic_file_path} to {jpg_file_path}")
+    # Open the HEIC file using pyheif
+    heif_file = pyheif.read(heic_file_path)
+
+    # Convert the HEIC data to a Pillow image
+    image = Image.frombytes(
+        heif_file.mode, 
+        heif_file.size, 
+        heif_file.data,
+        "raw",
+        heif_file.mode,
+        heif_file.stride,
+    )
+
+    # Save the image as a JPG
+    image.save(jpg_file_path, "JPEG")
+
+def timed_convert_heic_to_jpg(heic_file_path, jpg_file_path):
+    """Runs in a worker process, returns the CPU time of the conversion"""
+    cpu_start = time.process_time()
+    convert_heic_to_jpg(heic_file_path, jpg_file_path)
+    return time.process_time() - cpu_start
+
+# images decoded by check_image, other files of the cache (e.g. pages linked from a post) are not checked
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.heic', '.heif')
+
+def check_image(file_path):
+    """Returns None if the image is complete, else the reason why it is not.
+    The image is fully decoded : a truncated download fails even if its header is valid"""
+    try:
+        if os.path.getsize(file_path) == 0:
+            return "empty file"
+        if file_path.lower().endswith(('.heic', '.heif')):
+            pyheif.read(file_path)
+        else:
+            with Image.open(file_path) as img:
+                img.load()
+    except Exception as e:
+        return f"cannot decode: {e}"
+    return None
+
+def check_images(file_paths):
+    """check_image for a batch of files, returns the (file_path, error) of the broken ones"""
+    errors = []
+    for file_path in file_paths:
+        error = check_image(file_path)
+        if error:
+            errors.append((file_path, error))
+    return errors
+
+def image_dhash(file_path, hash_size=8):
+    """Perceptual hash of an image, returns (hash, width, height, thumbnail).
+    The image is reduced to (hash_size + 1) x hash_size grey pixels, each bit tells if a pixel is brighter than its right neighbour:
+    resized or recompressed versions of a photo get the same hash, or a hash a few bits apart.
+    The 8x8 colour thumbnail tells apart images with the same shapes in different colours"""
+    with Image.open(file_path) as img:
+        width, height = img.size
+        # jpeg images are decoded at a reduced scale, much faster than a full decoding
+        img.draft('RGB', (4 * hash_size, 4 * hash_size))
+        img = img.convert('RGB')
+        grey = img.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS).tobytes()
+        thumbnail = img.resize((8, 8), Image.BOX).tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (grey[offset + col] > grey[offset + col + 1])
+    return value, width, height, thumbnail
+
+def hash_images(file_paths):
+    """image_dhash for a batch of files, returns (file_path, hash, width, height, thumbnail), images which can not be decoded are left out"""
+    hashes = []
+    for file_path in file_paths:
+        try:
+            hashes.append((file_path, *image_dhash(file_path)))
+        except Exception as e:
+            print(f"Could not hash {file_path}: {e}")
+    return hashes
+
+class HeicConverter:
+    """Converts HEIC files to JPEG in a pool of processes, one per core by default.
+    The pool is only started when the first HEIC file is converted"""
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.lock = threading.Lock()
+        self.executor = None
+        # used to submit several blocking conversions at once
+        self.thread_pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def convert(self, heic_file_path, jpg_file_path):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        wall_start = time.perf_counter()
+        cpu = self.executor.submit(timed_convert_heic_to_jpg, heic_file_path, jpg_file_path).result()
+        metrics.add_stage("heic_conversion", time.perf_counter() - wall_start, cpu)
+
+    def shutdown(self):
+        self.thread_pool.shutdown(wait=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+class ImageFetcher:
+    """Downloads images of the cache in a thread pool, the http client adapts the number of downloads to the same host.
+    Requests for a url already being downloaded share the same download.
+    Files are added to the cache in the order add_file is called, so filenames do not depend on download order"""
+    def __init__(self, cache, workers=8, converter=None, offline=False, archive=None):
+        self.cache = cache
+        # offline : only the images already in the cache are used
+        self.offline = offline
+        # images missing in the cache are taken from the backup archive (utils.util_archive.Archive) before the network
+        self.archive = archive
+        self.converter = converter or HeicConverter()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.inflight = {}
+
+    def get_archive_path(self, url):
+        return self.archive.get_image_path(url) if self.archive else None
+
+    def get_image_key(self, url):
+        """Url under which the image of url is cached, see Cache.get_image_key.
+        The images of a backup archive are stored under the url they were downloaded from"""
+        if not self.cache.get_filename(url) and self.get_archive_path(url):
+            return url
+        return self.cache.get_image_key(url)
+
+    def download(self, url):
+        tmp_path = self.cache.get_tmp_path(url)
+        archive_path = self.get_archive_path(url)
+        if archive_path:
+            self.archive.extract_file(archive_path, tmp_path)
+            metrics.add("images_from_archive")
+        else:
+            with metrics.stage("image_download"):
+                metrics.add("bytes_images", get_client().download(url, tmp_path))
+        jpg_path = None
+        if UrlChecker(url).is_heic():
+            jpg_path = self.cache.try_convert_heic(tmp_path, self.converter)
+        return tmp_path, jpg_path
+
+    def prefetch(self, url):
+        """Start downloading url in the background, returns the download future, None if url is already cached"""
+        # a download stays in flight until its file is in the cache, so a url is never downloaded twice
+        with self.lock:
+            if url in self.inflight:
+                return self.inflight[url]
+            if self.cache.is_url_in_cache(url) or (self.offline and not self.get_archive_path(url)):
+                return None
+            self.inflight[url] = self.executor.submit(self.download, url)
+            return self.inflight[url]
+
+    def add_file(self, url, filename):
+        """Wait for the download of url and add it to the cache"""
+        future = self.prefetch(url)
+        if future is None:
+            return
+        try:
+            tmp_path, jpg_path = future.result()
+            self.cache.add_downloaded_file(url, filename, tmp_path, jpg_path)
+        finally:
+            with self.lock:
+                self.inflight.pop(url, None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.converter.shutdown()
+        # downloads that were never added to the cache
+        for entry in os.scandir(self.cache.tmp_dir):
+            if entry.name.endswith(".part"):
+                os.remove(entry.path)
+
+class PageCache:
+    """Raw html of the post pages, with their ETag and Last-Modified headers.
+    Cached pages are revalidated with a conditional GET : an unchanged page costs a 304 response without body.
+    Offline, cached pages are returned without any request"""
+    def __init__(self, cache_dir="cache", index_file="cache.db", offline=False, archive=None):
+        self.pages_dir = os.path.join(cache_dir, "pages")
+        self.offline = offline
+        # pages missing in the cache are read from the backup archive, e.g. for an --offline run from a backup
+        self.archive = archive
+        os.makedirs(self.pages_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, index_file), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, filename TEXT NOT NULL, etag TEXT, last_modified TEXT, fetched REAL)")
+        self.conn.commit()
+
+    def get_entry(self, url):
+        with self.lock:
+            return self.conn.execute("SELECT filename, etag, last_modified FROM pages WHERE url = ?", (url,)).fetchone()
+
+    def read(self, filename):
+        try:
+            with open(os.path.join(self.pages_dir, filename), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_filename(self, url):
+        return hashlib.sha1(url.encode()).hexdigest() + ".html"
+
+    def read_archive(self, url):
+        if self.archive is None:
+            return None
+        try:
+            content = self.archive.read_bytes("cache/pages/" + self.get_filename(url))
+        except FileNotFoundError:
+            return None
+        return content
+
+    def store(self, url, content, etag, last_modified):
+        filename = self.get_filename(url)
+        file_path = os.path.join(self.pages_dir, filename)
+        with open(file_path + ".part", 'wb') as f:
+            f.write(content)
+        os.replace(file_path + ".part", file_path)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)", (url, filename, etag, last_modified, time.time()))
+
+    def get(self, url, revalidate=True, only_modified=False):
+        """Content of the page, None if offline and the page is not cached.
+        revalidate=False returns a cached page without any request,
+        only_modified=True returns None when the cached page is still valid"""
+        entry = self.get_entry(url)
+        cached = self.read(entry[0]) if entry else None
+        if cached is None and (self.offline or not revalidate):
+            # no validators are kept with the archived pages, online they are downloaded again
+            cached = self.read_archive(url)
+            entry = None
+        if cached is not None and (self.offline or not revalidate):
+            metrics.add("pages_from_cache" if entry else "pages_from_archive")
+            return cached
+        if self.offline:
+            print(f"Page not in cache: {url}")
+            return None
+
+        headers = {}
+        if cached is not None:
+            if entry[1]:
+                headers["If-None-Match"] = entry[1]
+            if entry[2]:
+                headers["If-Modified-Since"] = entry[2]
+        response = get_client().get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            metrics.add("pages_not_modified")
+            return None if only_modified else cached
+        metrics.add("bytes_pages", len(response.content))
+        if response.status_code == 200:
+            self.store(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.content
+
+class Manifest:
+    """Association between a post url and the markdown file where it was saved.
+    The manifest file is append-only : one json line per saved post, the last line wins"""
+    def __init__(self, md_dir="md", manifest_file="manifest.jsonl"):
+        self.md_dir = md_dir
+        self.manifest_file = os.path.join(md_dir, manifest_file)
+        self.posts = self.load_manifest()
+
+    def load_manifest(self):
+        posts = {}
+        try:
+            with open(self.manifest_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # an interrupted run may leave a truncated last line
+                        print(f"Ignoring invalid manifest line: {line}")
+                        continue
+                    posts[entry['url']] = entry
+        except FileNotFoundError:
+            pass
+        return posts
+
+    def add(self, url, path, content_hash=None, updated=None):
+        """Record that url was saved in path, path being relative to the md directory.
+        content_hash and updated (date of the last update in the feed) are used by the sync mode"""
+        entry = {'url': url, 'path': path}
+        if content_hash:
+            entry['hash'] = content_hash
+        if updated:
+            entry['updated'] = updated
+        self.posts[url] = entry
+        with open(self.manifest_file, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def get_path(self, url):
+        entry = self.posts.get(url)
+        if entry:
+            return os.path.join(self.md_dir, entry['path'])
+        return None
+
+    def is_saved(self, url):
+        """True if the post was saved and its markdown file is still on disk"""
+        path = self.get_path(url)
+        return path is not None and os.path.isfile(path)
+
+# hosts of blogger images, their url contains the size of the image
+BLOGGER_IMAGE_HOST = re.compile(r'^(?:blogger\.googleusercontent\.com|lh\d+\.googleusercontent\.com|\d+\.bp\.blogspot\.com)$')
+# numbered mirrors serving the same images
+BP_MIRROR = re.compile(r'^\d+\.bp\.blogspot\.com$')
+# size option of a blogger image url: s1600, s320-c, w640-h480, w400-h300-rw, s1600-h...
+BLOGGER_SIZE = re.compile(r'^(?:s\d+|w\d+(?:-h\d+)?|h\d+)(?:-[a-z0-9]+)*$')
+
+def normalize_image_url(url):
+    """Url of the original image of a blogger image url: the size option (path segment before the file name,
+    or =size suffix) is replaced by s0, and the mirrors of bp.blogspot.com by the first one.
+    The thumbnail and the full size versions of an image then share one download. Other urls are returned as is"""
+    parts = urllib.parse.urlsplit(url)
+    host = parts.netloc.lower()
+    if not BLOGGER_IMAGE_HOST.match(host):
+        return url
+    if BP_MIRROR.match(host):
+        host = "1.bp.blogspot.com"
+    path = parts.path
+    segments = path.split('/')
+    if '=' in segments[-1]:
+        # https://blogger.googleusercontent.com/img/a/AVvXsEh...=w640-h480
+        base, size = path.rsplit('=', 1)
+        if BLOGGER_SIZE.match(size):
+            path = base + "=s0"
+    elif len(segments) > 2 and BLOGGER_SIZE.match(segments[-2]):
+        # https://blogger.googleusercontent.com/img/b/R29vZ2xl/AVvXsEh.../s1600/IMG_1.jpg
+        segments[-2] = "s0"
+        path = '/'.join(segments)
+    return urllib.parse.urlunsplit(("https", host, path, parts.query, parts.fragment))
+
 class UrlChecker:
     def __init__(self, url):
         self.url = url
@@ -110,18 +654,6 @@ class UrlChecker:
     # check if the url ends with an extension
     def has_extension(self,):
         return '.' in self.url.split('/')[-1]
-    
-if __name__ == "__main__":
-    cache = Cache()
-
-    for url, filename in cache.cache.items():
-        print(f"checking {filename}")
-        if not filename:
-            print(f"Deleting {url} from cache : no filename")
-            del cache.cache[url]
-        # check if the file exists
-        if not os.path.isfile(os.path.join(cache.images_dir, filename)):
-            print(f"Deleting {url} from cache  : file not found")
-            del cache.cache[url]
-
-    cache.save_cache()
\ No newline at end of file
+
+    def is_heic(self):
+        return self.has_extension() and self.url.split('.')[-1].lower() == "heic"